@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template_string, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template_string, session, redirect, url_for, g
 import uuid
 import os
 from college_chatbot import EnhancedCollegeRecommendationChatbot
@@ -34,6 +34,8 @@ def login_required(f):
             session.clear()
             return jsonify({'success': False, 'error': 'Session expired'}), 401
         
+        # Handlers read the verified user from the request context instead of re-verifying
+        g.user = user_data
         return f(*args, **kwargs)
     return decorated_function
 
@@ -338,6 +340,16 @@ DASHBOARD_TEMPLATE = """
             background: #c82333;
         }
         
+        .chat-search {
+            width: 100%;
+            margin-top: 10px;
+            padding: 8px 10px;
+            border: 1px solid #ddd;
+            border-radius: 6px;
+            font-size: 14px;
+            box-sizing: border-box;
+        }
+        
         .chat-list {
             flex: 1;
             overflow-y: auto;
@@ -399,6 +411,17 @@ DASHBOARD_TEMPLATE = """
             word-wrap: break-word;
         }
         
+        .load-earlier {
+            display: block;
+            margin: 0 auto 15px;
+            padding: 6px 14px;
+            border: 1px solid #dee2e6;
+            border-radius: 14px;
+            background: #ffffff;
+            color: #007bff;
+            cursor: pointer;
+        }
+        
         .user-message {
             background: #007bff;
             color: white;
@@ -528,6 +551,7 @@ DASHBOARD_TEMPLATE = """
         <div class="chat-controls">
             <button class="new-chat-btn" onclick="createNewChat()">+ New Chat</button>
             <button class="logout-btn" onclick="logout()">Logout</button>
+            <input type="text" id="chatSearch" class="chat-search" placeholder="Search your chats..." oninput="searchChats()">
         </div>
         
         <div class="chat-list" id="chatList">
@@ -567,6 +591,7 @@ DASHBOARD_TEMPLATE = """
     <script>
         let currentChatId = null;
         let currentUser = null;
+        let oldestMessageId = null;
         
         // Initialize dashboard
         document.addEventListener('DOMContentLoaded', async function() {
@@ -621,6 +646,49 @@ DASHBOARD_TEMPLATE = """
             }
         }
         
+        let searchTimer = null;
+        
+        function searchChats() {
+            // Debounce: search once the user pauses typing
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(async () => {
+                const query = document.getElementById('chatSearch').value.trim();
+                if (!query) {
+                    await loadChatList();
+                    return;
+                }
+                
+                try {
+                    const response = await fetch(`/chats/search?q=${encodeURIComponent(query)}`);
+                    const data = await response.json();
+                    
+                    if (data.success) {
+                        const chatList = document.getElementById('chatList');
+                        chatList.innerHTML = '';
+                        
+                        if (data.results.length === 0) {
+                            chatList.innerHTML = '<div class="chat-item"><div class="chat-meta">No matching chats</div></div>';
+                        }
+                        
+                        data.results.forEach(result => {
+                            const chatItem = document.createElement('div');
+                            chatItem.className = 'chat-item';
+                            chatItem.onclick = () => selectChat(result.session_id, result.title);
+                            
+                            chatItem.innerHTML = `
+                                <div class="chat-title">${result.title}</div>
+                                <div class="chat-meta">${result.message.snippet}</div>
+                            `;
+                            
+                            chatList.appendChild(chatItem);
+                        });
+                    }
+                } catch (error) {
+                    console.error('Error searching chats:', error);
+                }
+            }, 250);
+        }
+        
         function formatDate(dateString) {
             const date = new Date(dateString);
             return date.toLocaleDateString() + ' ' + date.toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
@@ -658,6 +726,7 @@ DASHBOARD_TEMPLATE = """
                         addMessageToUI(message.content, message.type);
                     });
                     
+                    updateLoadEarlierButton(data.next_before_id);
                     scrollToBottom();
                 }
             } catch (error) {
@@ -665,6 +734,47 @@ DASHBOARD_TEMPLATE = """
             }
         }
         
+        async function loadEarlierMessages() {
+            if (!currentChatId || !oldestMessageId) return;
+            
+            try {
+                const response = await fetch(`/chat/${currentChatId}/history?before=${oldestMessageId}`);
+                const data = await response.json();
+                
+                if (data.success) {
+                    const messagesDiv = document.getElementById('chatMessages');
+                    const firstMessage = messagesDiv.querySelector('.message');
+                    const previousHeight = messagesDiv.scrollHeight;
+                    
+                    data.messages.forEach(message => {
+                        addMessageToUI(message.content, message.type, firstMessage);
+                    });
+                    
+                    updateLoadEarlierButton(data.next_before_id);
+                    // Keep the message the user was reading in place
+                    messagesDiv.scrollTop += messagesDiv.scrollHeight - previousHeight;
+                }
+            } catch (error) {
+                console.error('Error loading earlier messages:', error);
+            }
+        }
+        
+        function updateLoadEarlierButton(beforeId) {
+            oldestMessageId = beforeId;
+            const messagesDiv = document.getElementById('chatMessages');
+            const existing = document.getElementById('loadEarlierButton');
+            if (existing) existing.remove();
+            
+            if (beforeId) {
+                const button = document.createElement('button');
+                button.id = 'loadEarlierButton';
+                button.className = 'load-earlier';
+                button.textContent = 'Load earlier messages';
+                button.onclick = loadEarlierMessages;
+                messagesDiv.insertBefore(button, messagesDiv.firstChild);
+            }
+        }
+        
         async function createNewChat() {
             try {
                 const response = await fetch('/new-chat', {
@@ -779,7 +889,7 @@ DASHBOARD_TEMPLATE = """
             }
         }
         
-        function addMessageToUI(message, sender) {
+        function addMessageToUI(message, sender, beforeNode = null) {
             const messagesDiv = document.getElementById('chatMessages');
             const messageDiv = document.createElement('div');
             messageDiv.className = `message ${sender === 'human' ? 'user' : 'bot'}-message`;
@@ -827,8 +937,13 @@ DASHBOARD_TEMPLATE = """
                 messageDiv.innerHTML = `<strong>${sender === 'human' ? 'You' : 'Bot'}:</strong> ${message}`;
             }
 
-            messagesDiv.appendChild(messageDiv);
-            scrollToBottom();
+            if (beforeNode) {
+                // Older history is inserted above what is already shown
+                messagesDiv.insertBefore(messageDiv, beforeNode);
+            } else {
+                messagesDiv.appendChild(messageDiv);
+                scrollToBottom();
+            }
         }
         
         function scrollToBottom() {
@@ -915,7 +1030,7 @@ def dashboard():
 def get_user_info():
     """Get current user information"""
     try:
-        user_data = chatbot.db_manager.verify_session_token(session['session_token'])
+        user_data = g.user
         if user_data['success']:
             return jsonify({
                 'success': True,
@@ -935,7 +1050,7 @@ def get_user_info():
 def get_chats():
     """Get all chat sessions for the current user"""
     try:
-        user_data = chatbot.db_manager.verify_session_token(session['session_token'])
+        user_data = g.user
         if user_data['success']:
             chats = chatbot.db_manager.get_user_chat_sessions(user_data['user_id'])
             return jsonify({'success': True, 'chats': chats})
@@ -944,12 +1059,29 @@ def get_chats():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/chats/search')
+@login_required
+def search_chats():
+    """Full-text search over the current user's chat history"""
+    try:
+        user_data = g.user
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Search query cannot be empty'})
+        
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        results = chatbot.db_manager.search_chat_history(user_data['user_id'], query, limit)
+        return jsonify({'success': True, 'results': results})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/new-chat', methods=['POST'])
 @login_required
 def create_new_chat():
     """Create a new chat session"""
     try:
-        user_data = chatbot.db_manager.verify_session_token(session['session_token'])
+        user_data = g.user
         if user_data['success']:
             session_id = chatbot.db_manager.create_chat_session(user_data['user_id'])
             return jsonify({'success': True, 'session_id': session_id})
@@ -963,7 +1095,7 @@ def create_new_chat():
 def chat_with_bot(session_id):
     """Send message to chatbot"""
     try:
-        user_data = chatbot.db_manager.verify_session_token(session['session_token'])
+        user_data = g.user
         if not user_data['success']:
             return jsonify({'success': False, 'error': 'Invalid session'})
         
@@ -974,7 +1106,7 @@ def chat_with_bot(session_id):
             return jsonify({'success': False, 'error': 'Message cannot be empty'})
         
         # Check if this is a new chat (no messages yet)
-        existing_messages = chatbot.db_manager.get_session_messages(session_id, user_data['user_id'])
+        existing_messages = chatbot.db_manager.get_recent_messages(session_id, user_data['user_id'], limit=1)
         is_new_chat = len(existing_messages) == 0
         
         # Get response from chatbot
@@ -991,14 +1123,87 @@ def chat_with_bot(session_id):
 @app.route('/chat/<session_id>/history')
 @login_required
 def get_chat_history(session_id):
-    """Get chat history for a specific session"""
+    """Get a page of chat history; pass ?before=<next_before_id> for older messages"""
     try:
-        user_data = chatbot.db_manager.verify_session_token(session['session_token'])
+        user_data = g.user
         if not user_data['success']:
             return jsonify({'success': False, 'error': 'Invalid session'})
         
-        messages = chatbot.db_manager.get_session_messages(session_id, user_data['user_id'])
-        return jsonify({'success': True, 'messages': messages})
+        before_id = request.args.get('before', type=int)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        
+        page = chatbot.db_manager.get_messages_page(session_id, user_data['user_id'], limit, before_id)
+        return jsonify({
+            'success': True,
+            'messages': page['messages'],
+            'next_before_id': page['next_before_id']
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/chat/<session_id>/recommendations')
+@login_required
+def get_recommendations(session_id):
+    """Get a page of database recommendations for the chat's saved preferences"""
+    try:
+        user_data = g.user
+        if not user_data['success']:
+            return jsonify({'success': False, 'error': 'Invalid session'})
+        
+        if not chatbot.db_manager.verify_session_ownership(session_id, user_data['user_id']):
+            return jsonify({'success': False, 'error': 'Chat not found'})
+        
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 3, type=int), 1), 20)
+        
+        page = chatbot.get_recommendation_page(session_id, user_data['user_id'], offset, limit)
+        return jsonify({'success': True, **page})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/search')
+@login_required
+def search_colleges():
+    """Free-text search over the college catalog"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Search query cannot be empty'})
+        
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+        results = [
+            {**item['college'].to_dict(), 'search_score': item['score']}
+            for item in chatbot.data_manager.search_colleges(query, limit)
+        ]
+        return jsonify({'success': True, 'results': results})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/colleges/<college_id>/similar')
+@login_required
+def get_similar_colleges(college_id):
+    """Get colleges similar to the given one"""
+    try:
+        limit = min(max(request.args.get('limit', 5, type=int), 1), 10)
+        catalog = chatbot.data_manager.catalog
+        rows = catalog.rows_by_id.get(college_id, [])
+        if not rows:
+            return jsonify({'success': False, 'error': 'College not found'}), 404
+        if len(rows) > 1 or college_id == 'nan':
+            # Several spreadsheet rows share this ID, or it is a missing ID read as 'nan'; either way
+            # it names no single college
+            return jsonify({'success': False, 'error': f'College ID {college_id} is ambiguous ({len(rows)} colleges)'}), 409
+        
+        similar = chatbot.data_manager.similar_rows(rows[0], limit, catalog)
+        
+        results = [
+            {**item['college'].to_dict(), 'similarity': item['score']}
+            for item in similar
+        ]
+        return jsonify({'success': True, 'colleges': results})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -1008,7 +1213,7 @@ def get_chat_history(session_id):
 def delete_chat(session_id):
     """Delete a chat session"""
     try:
-        user_data = chatbot.db_manager.verify_session_token(session['session_token'])
+        user_data = g.user
         if not user_data['success']:
             return jsonify({'success': False, 'error': 'Invalid session'})
         
@@ -1022,6 +1227,20 @@ def delete_chat(session_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/metrics')
+@login_required
+def metrics():
+    """Operational metrics: database maintenance progress, table sizes, cache and local fast-path hit rates"""
+    try:
+        return jsonify({'success': True, 'metrics': {
+            'database': chatbot.db_manager.get_metrics(),
+            'intent': chatbot.intent_classifier.stats(),
+            'preferences': chatbot.data_manager.preference_extractor.stats(),
+            'llm_cache': chatbot.llm_cache.stats()
+        }})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,271 @@
+"""Benchmarks for the college recommendation backend.
+
+Usage:
+    python benchmarks.py memory [--excel college_data.xlsx] [--scale 100]
+    python benchmarks.py queries [--users 1000] [--messages 1000000]
+    python benchmarks.py login [--concurrency 16] [--logins 200] [--rounds 12] [--workers N]
+    python benchmarks.py intent [--threshold 0.85]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from college_catalog import CollegeCatalog
+from college_chatbot import College, CollegeDataManager
+from enhanced_college_chatbot import (
+    ARCHIVED_PAGE_SQL, MESSAGES_PAGE_SQL, RECENT_MESSAGES_SQL, SEARCH_HITS_SQL, SESSION_MESSAGES_SQL,
+    USER_CHATS_SQL, VERIFY_TOKEN_SQL, EnhancedDatabaseManager
+)
+from intent_classifier import IntentClassifier
+
+
+@dataclass
+class LegacyCollege:
+    """The plain dataclass College used before the compact representation"""
+    college_id: str
+    name: str
+    type: str
+    affiliation: str
+    location: str
+    website: str
+    contact: str
+    email: str
+    courses: str
+    scholarship: str
+    admission_process: str
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _retained_bytes(build) -> int:
+    """Bytes still allocated after build() returns, i.e. memory retained by its result"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return retained
+
+
+def benchmark_memory(excel_path: str, scale: int):
+    """Compare resident memory of the legacy dataclass and the compact College, alone and with their catalog"""
+    manager = CollegeDataManager(excel_path, reload_interval=0)
+    rows = [college.to_dict() for college in manager.read_college_data()]
+
+    def build(cls):
+        # Fresh string copies, as a real Excel load would allocate them
+        return [
+            cls(**{name: (value + '.')[:-1] for name, value in row.items()})
+            for _ in range(scale)
+            for row in rows
+        ]
+
+    def build_with_catalog(cls):
+        colleges = build(cls)
+        return colleges, CollegeCatalog(colleges)
+
+    count = len(rows) * scale
+    print(f"Colleges: {count} ({len(rows)} rows x {scale})")
+    # The records alone overstate the saving: the catalog's indexes are the same size either way
+    for label, builder in (('records', build), ('records + catalog', build_with_catalog)):
+        before = _retained_bytes(lambda: builder(LegacyCollege))
+        after = _retained_bytes(lambda: builder(College))
+        print(f"  {label}:")
+        print(f"    dataclass College:  {before / 1024 / 1024:8.2f} MiB  ({before / count:7.0f} B/college)")
+        print(f"    compact College:    {after / 1024 / 1024:8.2f} MiB  ({after / count:7.0f} B/college)")
+        print(f"    saved:              {(1 - after / before) * 100:7.1f} %")
+
+
+# Hot queries of EnhancedDatabaseManager as (label, sql, parameter names)
+HOT_QUERIES = [
+    ('session messages', SESSION_MESSAGES_SQL, ('session_id', 'user_id')),
+    ('recent messages', RECENT_MESSAGES_SQL, ('session_id', 'user_id', 'limit')),
+    ('message page', MESSAGES_PAGE_SQL, ('session_id', 'user_id', 'before_timestamp', 'before_id', 'limit')),
+    ('archived page', ARCHIVED_PAGE_SQL, ('session_id', 'user_id', 'before_timestamp', 'before_id', 'limit')),
+    ('user chat list', USER_CHATS_SQL, ('user_id',)),
+    ('verify token', VERIFY_TOKEN_SQL, ('session_token',)),
+    ('history search', SEARCH_HITS_SQL, ('search', 'limit', 'offset')),
+]
+
+
+def _seed_database(db: EnhancedDatabaseManager, users: int, messages: int) -> dict:
+    """Fill the database with synthetic users, chats and messages; returns sample keys"""
+    sessions_per_user = 5
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    session_ids = [(str(uuid.uuid4()), user_id) for user_id in user_ids for _ in range(sessions_per_user)]
+    with db.pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+            ((user_id, f'user{i}', f'user{i}@example.com', 'x') for i, user_id in enumerate(user_ids))
+        )
+        conn.executemany(
+            'INSERT INTO user_sessions (session_token, user_id, expires_at) VALUES (?, ?, datetime("now", "+7 days"))',
+            ((f'token-{i}', user_id) for i, user_id in enumerate(user_ids))
+        )
+        conn.executemany(
+            'INSERT INTO chat_sessions (session_id, user_id) VALUES (?, ?)', session_ids
+        )
+        conn.executemany(
+            'INSERT INTO messages (session_id, user_id, message_type, content, timestamp) '
+            'VALUES (?, ?, ?, ?, datetime("now", ?))',
+            (
+                (*session_ids[i % len(session_ids)], 'user' if i % 2 == 0 else 'bot',
+                 f'message {i}', f'-{messages - i} seconds')
+                for i in range(messages)
+            )
+        )
+    session_id, user_id = session_ids[len(session_ids) // 2]
+    with db.pool.connection() as conn:
+        before_id, before_timestamp = conn.execute(
+            'SELECT id, timestamp FROM messages WHERE session_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET 10',
+            (session_id,)
+        ).fetchone() or (0, '')
+    return {
+        'session_id': session_id, 'user_id': user_id, 'session_token': f'token-{users // 2}',
+        'before_timestamp': before_timestamp, 'before_id': before_id, 'limit': 50, 'offset': 0,
+        'search': f'owner : "{user_id.replace("-", "")}" AND content : ("message")'
+    }
+
+
+def benchmark_queries(users: int, messages: int, repeat: int = 200) -> bool:
+    """Show the query plan and latency of the hot chat queries; False if any of them scans a table"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = EnhancedDatabaseManager(os.path.join(directory, 'benchmark.db'))
+        print(f"Seeding {users} users, {users * 5} chats, {messages} messages...")
+        params = _seed_database(db, users, messages)
+
+        all_indexed = True
+        with db.pool.connection() as conn:
+            conn.execute('ANALYZE')
+            for label, sql, names in HOT_QUERIES:
+                values = tuple(params[name] for name in names)
+                plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, values)]
+                # A full-text index lookup shows up as a SCAN of the virtual table
+                scans = [
+                    step for step in plan
+                    if (step.startswith('SCAN') and 'VIRTUAL TABLE' not in step) or 'TEMP B-TREE' in step
+                ]
+                all_indexed = all_indexed and not scans
+
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    conn.execute(sql, values).fetchall()
+                elapsed = (time.perf_counter() - start) / repeat
+
+                print(f"{label}: {elapsed * 1000:.3f} ms  [{'ok' if not scans else 'FULL SCAN / SORT'}]")
+                for step in plan:
+                    print(f"    {step}")
+        db.close()
+    return all_indexed
+
+
+def benchmark_login(concurrency: int, logins: int, rounds: int, workers: int, max_pending: int):
+    """Login throughput and latency with `concurrency` clients hammering authenticate_user"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = EnhancedDatabaseManager(
+            os.path.join(directory, 'benchmark.db'),
+            bcrypt_rounds=rounds,
+            bcrypt_workers=workers or None,
+            bcrypt_max_pending=max_pending
+        )
+        users = [(f'user{i}', f'password{i}') for i in range(concurrency)]
+        for username, password in users:
+            db.create_user(username, f'{username}@example.com', password)
+
+        def login(i):
+            username, password = users[i % len(users)]
+            start = time.perf_counter()
+            result = db.authenticate_user(username, password)
+            return time.perf_counter() - start, result['success']
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            results = list(clients.map(login, range(logins)))
+        elapsed = time.perf_counter() - start
+        db.close()
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    failed = len(results) - len(latencies)
+    print(f"bcrypt cost {rounds}, {db.password_hasher.workers} hashing workers, "
+          f"{concurrency} concurrent clients")
+    print(f"  logins:      {len(latencies)} ok, {failed} rejected ({db.password_hasher.rejected} by queue limit)")
+    print(f"  throughput:  {len(latencies) / elapsed:.1f} logins/s")
+    if latencies:
+        print(f"  latency p50: {latencies[len(latencies) // 2] * 1000:.0f} ms")
+        print(f"  latency p99: {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.0f} ms")
+
+
+# Typical chat turns for the intent fast path
+INTENT_SAMPLES = [
+    'hi', 'hello, I need some help', 'thanks a lot', 'ok', 'I am from Indore',
+    "I'm interested in engineering", 'what is the eligibility for MBBS', 'how does JEE counselling work',
+    'I want engineering colleges in Pune', 'which college is best for MBA in Delhi',
+    'suggest some private colleges', 'show me colleges like BITS', 'any good colleges for commerce?',
+    'my budget is around 2 lakh per year', 'government colleges only please', 'what about hostels?',
+]
+
+
+def benchmark_intent(threshold: float, repeat: int = 2000):
+    """Latency of the local intent classifier and how many turns it decides without the LLM"""
+    classifier = IntentClassifier(threshold=threshold)
+    for text in INTENT_SAMPLES:
+        decision, confidence = classifier.classify(text)
+        label = 'LLM' if decision is None else ('recommend' if decision else 'chat')
+        print(f"  {label:9s} {confidence:.2f}  {text}")
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in INTENT_SAMPLES:
+            classifier.classify(text)
+    elapsed = (time.perf_counter() - start) / (repeat * len(INTENT_SAMPLES))
+
+    stats = classifier.stats()
+    print(f"threshold {threshold}: {stats['fast_path_hit_rate'] * 100:.0f} % decided locally, "
+          f"{elapsed * 1e6:.1f} us per message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    memory = subparsers.add_parser('memory', help='memory per College record, before and after')
+    memory.add_argument('--excel', default='college_data.xlsx')
+    memory.add_argument('--scale', type=int, default=100, help='times to replicate the catalog')
+
+    queries = subparsers.add_parser('queries', help='query plans and latency of the hot chat queries')
+    queries.add_argument('--users', type=int, default=1000)
+    queries.add_argument('--messages', type=int, default=1000000)
+
+    login = subparsers.add_parser('login', help='login throughput under concurrent clients')
+    login.add_argument('--concurrency', type=int, default=16)
+    login.add_argument('--logins', type=int, default=200)
+    login.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor')
+    login.add_argument('--workers', type=int, default=0, help='hashing workers (default: one per CPU)')
+    login.add_argument('--max-pending', type=int, default=64, help='queued hashes before logins are rejected')
+
+    intent = subparsers.add_parser('intent', help='latency and fast-path rate of the intent classifier')
+    intent.add_argument('--threshold', type=float, default=0.85, help='confidence needed to skip the LLM')
+
+    args = parser.parse_args()
+    if args.benchmark == 'memory':
+        benchmark_memory(args.excel, args.scale)
+    elif args.benchmark == 'queries':
+        if not benchmark_queries(args.users, args.messages):
+            raise SystemExit(1)
+    elif args.benchmark == 'login':
+        benchmark_login(args.concurrency, args.logins, args.rounds, args.workers, args.max_pending)
+    elif args.benchmark == 'intent':
+        benchmark_intent(args.threshold)
+
+
+if __name__ == '__main__':
+    main()
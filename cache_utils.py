@@ -0,0 +1,197 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def llm_cache_key(model: str, params: Dict, prompt: str) -> str:
+    """Cache key for an LLM call; prompts differing only in case or whitespace share a key"""
+    normalized = ' '.join(prompt.split()).casefold()
+    canonical = json.dumps({'model': model, 'params': params, 'prompt': normalized}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ttl seconds after being stored"""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or default if it is missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entries beyond max_size"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Persistent cache of JSON-serializable values in a SQLite file.
+
+    Same interface as TTLCache. Expiry uses wall-clock time so entries stay
+    valid across restarts; beyond max_size the least recently used entries
+    are evicted. The size is counted in the file, not in the process, so the
+    bound holds when several workers share one cache file.
+    """
+
+    def __init__(self, path: str, max_size: int = 10000, ttl: Optional[float] = None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_last_used ON cache_entries (last_used)')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value, or default if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None:
+                value, expires_at = row
+                if expires_at is None or expires_at > now:
+                    self._conn.execute('UPDATE cache_entries SET last_used = ? WHERE key = ?', (now, key))
+                    self.hits += 1
+                    return json.loads(value)
+                self._conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting expired and then least recently used entries beyond max_size"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)',
+                    (key, json.dumps(value), expires_at, now)
+                )
+                # Counted inside the write transaction, as other processes may write to the same file
+                size = self._conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+                if size > self.max_size:
+                    size -= self._conn.execute(
+                        'DELETE FROM cache_entries WHERE expires_at <= ?', (now,)
+                    ).rowcount
+                    overflow = size - self.max_size
+                    if overflow > 0:
+                        self._conn.execute('''
+                            DELETE FROM cache_entries WHERE key IN (
+                                SELECT key FROM cache_entries ORDER BY last_used LIMIT ?
+                            )
+                        ''', (overflow,))
+                        self.evictions += overflow
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return default
+            self._conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            return json.loads(row[0])
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._conn.execute('DELETE FROM cache_entries')
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': self._count(),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _count(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
@@ -0,0 +1,467 @@
+import os
+import re
+import sys
+import pickle
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from college_search import BM25Index, SimilarityIndex
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Bump whenever the pickled catalog layout changes so stale snapshots are rebuilt
+SNAPSHOT_VERSION = 9
+
+# Upper bound on remembered query-token expansions per column
+MAX_EXPANSION_CACHE = 4096
+
+# Course levels; a course's level is stored as its index in this tuple
+LEVELS = ('UG', 'PG', 'DOCTORAL', 'DIPLOMA', 'CERTIFICATE')
+UNKNOWN_LEVEL = -1
+
+LEVEL_ALIASES = {
+    'ug': 'UG', 'undergraduate': 'UG', 'under graduate': 'UG', 'bachelor': 'UG', 'bachelors': 'UG',
+    'pg': 'PG', 'postgraduate': 'PG', 'post graduate': 'PG', 'master': 'PG', 'masters': 'PG',
+    'phd': 'DOCTORAL', 'ph.d': 'DOCTORAL', 'doctoral': 'DOCTORAL', 'doctorate': 'DOCTORAL',
+    'diploma': 'DIPLOMA', 'diplomas': 'DIPLOMA', 'certificate': 'CERTIFICATE', 'certificates': 'CERTIFICATE',
+}
+
+# Canonical course code -> pattern for the ways it is written in the Courses column.
+# Longer codes come first so that e.g. "BA.LLB" is not read as "BA".
+COURSE_PATTERNS = {
+    'BALLB': r'BA\.?\s?LL\.?B', 'BTECH': r'B\.?\s?Tech', 'MTECH': r'M\.?\s?Tech',
+    'BARCH': r'B\.?\s?Arch', 'BDES': r'B\.?\s?Des', 'MDES': r'M\.?\s?Des',
+    'BPHARM': r'B\.?\s?Pharm', 'MPHARM': r'M\.?\s?Pharm', 'BSTAT': r'B\.?\s?Stat', 'MSTAT': r'M\.?\s?Stat',
+    'BSC': r'B\.?\s?Sc', 'MSC': r'M\.?\s?Sc', 'BCOM': r'B\.?\s?Com', 'MCOM': r'M\.?\s?Com',
+    'BED': r'B\.?\s?Ed', 'MPHIL': r'M\.?\s?Phil', 'PHD': r'Ph\.?\s?D',
+    'MBBS': r'MBBS', 'BBA': r'BBA', 'MBA': r'MBA', 'BCA': r'BCA', 'MCA': r'MCA', 'BDS': r'BDS', 'BPT': r'BPT',
+    'BJMC': r'BJMC', 'MJMC': r'MJMC', 'PGDM': r'PGDM', 'PGP': r'PGP', 'FPM': r'FPM',
+    'LLB': r'LL\.?B', 'LLM': r'LL\.?M', 'MD': r'MD', 'MS': r'MS',
+    'BE': r'B\.?E', 'ME': r'M\.?E', 'BA': r'B\.?A', 'MA': r'M\.?A',
+}
+
+# Course codes whose level cannot be read from a leading B/M
+COURSE_LEVELS = {
+    'MBBS': 'UG', 'BALLB': 'UG', 'LLB': 'UG', 'LLM': 'PG', 'PGDM': 'PG', 'PGP': 'PG', 'MD': 'PG', 'MS': 'PG',
+    'PHD': 'DOCTORAL', 'MPHIL': 'DOCTORAL', 'FPM': 'DOCTORAL',
+}
+
+COURSE_PATTERN = re.compile(
+    '|'.join(f'(?<![A-Za-z])(?P<{code}>{pattern})(?![A-Za-z])' for code, pattern in COURSE_PATTERNS.items())
+)
+LEVEL_PATTERN = re.compile(r'\b(UG|PG|undergraduate|postgraduate|doctoral|diplomas?|certificates?)\b', re.IGNORECASE)
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(?:[–-]\s*\d+(?:\.\d+)?\s*)?(?:yrs?|years?)\b', re.IGNORECASE)
+# The rupee sign also appears mis-decoded as "â‚¹" in the spreadsheet
+AMOUNT_PATTERN = re.compile(
+    r'(?:₹|â‚¹|\brs\.?|\binr)?\s*~?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|l|lakhs?|lacs?|cr|crores?)?\b', re.IGNORECASE
+)
+FEE_PATTERN = re.compile(r'(?:₹|â‚¹)\s*~?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|l|lakhs?|lacs?|cr|crores?)?\b', re.IGNORECASE)
+SEGMENT_SEPARATOR = re.compile(r'\s*(?:\||;|\n|(?<=\))\s*,)\s*')
+AMOUNT_UNITS = {'k': 1e3, 'l': 1e5, 'lakh': 1e5, 'lakhs': 1e5, 'lac': 1e5, 'lacs': 1e5, 'cr': 1e7, 'crore': 1e7, 'crores': 1e7}
+
+# Annual fee ceilings for the budget words users tend to give
+BUDGET_CEILINGS = {'low': 100000, 'cheap': 100000, 'affordable': 100000, 'medium': 300000, 'moderate': 300000, 'mid': 300000}
+
+
+# Words that say nothing about which college a name refers to
+GENERIC_NAME_WORDS = frozenset(
+    'of the and college colleges university institute institution school academy campus online'.split()
+)
+
+# Annual fee buckets (upper bounds in INR) used as similarity features
+FEE_BUCKETS = (50000, 100000, 300000, 500000)
+
+# Words too common in questions (or in every college's record) to help free-text search
+SEARCH_STOPWORDS = frozenset(
+    'a an and any are as at be best by can do for from good i in is it me my of on or show some suggest '
+    'that the their there to want what where which who with '
+    'about also college colleges find get give help institute institutes like looking more need options '
+    'please recommend recommendation recommendations should suggestions tell top universities university '
+    'would'.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized lowercase alphanumeric tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def search_tokens(text: str) -> List[str]:
+    """Tokens used by free-text search, without stopwords"""
+    return [token for token in tokenize(text) if token not in SEARCH_STOPWORDS]
+
+
+def normalize_course_code(text: str) -> str:
+    """Canonical course code for a course name, e.g. "B.Tech" -> "BTECH" """
+    return re.sub(r'[^A-Z0-9]', '', text.upper())
+
+
+def normalize_level(text: str) -> Optional[int]:
+    """Index into LEVELS for a level preference such as "UG" or "Postgraduate", if recognized"""
+    level = LEVEL_ALIASES.get(text.strip().lower())
+    return LEVELS.index(level) if level else None
+
+
+def _course_level(code: str) -> int:
+    level = COURSE_LEVELS.get(code) or {'B': 'UG', 'M': 'PG'}.get(code[0])
+    return LEVELS.index(level) if level else UNKNOWN_LEVEL
+
+
+def _amount(number: str, unit: Optional[str]) -> float:
+    return float(number.replace(',', '')) * AMOUNT_UNITS.get((unit or '').lower(), 1)
+
+
+def parse_budget(budget_range: str) -> Optional[float]:
+    """Maximum annual fee implied by a budget preference, or None for no ceiling"""
+    text = budget_range.lower()
+    amounts = [_amount(number, unit) for number, unit in AMOUNT_PATTERN.findall(text)]
+    if amounts:
+        return max(amounts)
+    for word, ceiling in BUDGET_CEILINGS.items():
+        if word in text:
+            return ceiling
+    return None
+
+
+def parse_courses(text: str) -> List[Tuple[str, int, float, float]]:
+    """Parse the packed Courses column into (code, level, duration_years, annual_fee) records.
+
+    Unknown durations and fees are NaN. Segments that only name levels
+    ("UG, PG, PhD in Arts") produce records with an empty code.
+    """
+    records = []
+    for segment in SEGMENT_SEPARATOR.split(text):
+        if not segment:
+            continue
+        codes = list(dict.fromkeys(match.lastgroup for match in COURSE_PATTERN.finditer(segment)))
+        levels = list(dict.fromkeys(LEVEL_ALIASES[level.lower()] for level in LEVEL_PATTERN.findall(segment)))
+        duration = DURATION_PATTERN.search(segment)
+        duration = float(duration.group(1)) if duration else np.nan
+        fee = FEE_PATTERN.search(segment)
+        fee = _amount(fee.group(1), fee.group(2)) if fee else np.nan
+
+        covered = set()
+        for code in codes:
+            level = _course_level(code)
+            if len(levels) == 1 and (len(codes) == 1 or level == UNKNOWN_LEVEL):
+                if code in COURSE_LEVELS:
+                    # A known level wins; the stated one only labelled this course
+                    covered.add(LEVELS.index(levels[0]))
+                else:
+                    # A single stated level beats the one guessed from a leading B/M
+                    level = LEVELS.index(levels[0])
+            covered.add(level)
+            records.append((code, level, duration, fee))
+        for level in levels:
+            if LEVELS.index(level) not in covered:
+                records.append(('', LEVELS.index(level), duration, fee))
+    return records
+
+
+class CourseTable:
+    """Typed per-course records parsed from the Courses column, stored as parallel arrays"""
+
+    def __init__(self, course_records: List[List[Tuple[str, int, float, float]]]):
+        self.size = len(course_records)
+        colleges, codes, levels, durations, fees = [], [], [], [], []
+        code_rows = {}
+        for row, records in enumerate(course_records):
+            for code, level, duration, fee in records:
+                if code:
+                    code_rows.setdefault(code, set()).add(row)
+                colleges.append(row)
+                codes.append(code)
+                levels.append(level)
+                durations.append(duration)
+                fees.append(fee)
+
+        self.college = np.array(colleges, dtype=np.int32)
+        self.code = np.array(codes, dtype=object)
+        self.level = np.array(levels, dtype=np.int8)
+        self.duration = np.array(durations, dtype=np.float32)
+        self.fee = np.array(fees, dtype=np.float64)
+
+        # Per-college aggregates: bitmask of offered levels and cheapest known annual fee
+        known = self.level != UNKNOWN_LEVEL
+        self.level_mask = np.zeros(self.size, dtype=np.uint8)
+        np.bitwise_or.at(self.level_mask, self.college[known], (1 << self.level[known]).astype(np.uint8))
+        self.min_fee = np.full(self.size, np.nan)
+        np.fmin.at(self.min_fee, self.college, self.fee)
+
+        self.code_rows = {code: np.array(sorted(rows), dtype=np.int32) for code, rows in code_rows.items()}
+
+    def colleges_with_level(self, level: int) -> np.ndarray:
+        """Sorted ids of colleges offering at least one course at the given level"""
+        return np.flatnonzero(self.level_mask & (1 << level)).astype(np.int32)
+
+    def colleges_offering(self, course: str) -> np.ndarray:
+        """Sorted ids of colleges offering the given course, e.g. "BTech" or "B.Tech" """
+        return self.code_rows.get(normalize_course_code(course), np.zeros(0, dtype=np.int32))
+
+    def colleges_by_fee(self, max_fee: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids of colleges whose cheapest known fee is within, and above, the given ceiling"""
+        known = ~np.isnan(self.min_fee)
+        within = known & (self.min_fee <= max_fee)
+        return np.flatnonzero(within).astype(np.int32), np.flatnonzero(known & ~within).astype(np.int32)
+
+
+class CollegeCatalog:
+    """Column-oriented view of the college catalog used for vectorized filtering"""
+
+    # Text columns that are matched against user preferences
+    TEXT_COLUMNS = ('location', 'type', 'courses')
+    # Columns whose lowercased text is kept for substring checks. Courses text is long and
+    # already covered by the postings and the course table, so the few candidates left
+    # after the postings are checked against the compressed record instead.
+    LOWERED_COLUMNS = ('location', 'type')
+
+    def __init__(self, colleges: List, version: int = 1, previous: Optional['CollegeCatalog'] = None):
+        self.colleges = colleges
+        self.size = len(colleges)
+        self.version = version
+
+        # Per-college derived data (short lowercased text, token sets, parsed courses, term counts). Colleges
+        # carried over unchanged from the previous version keep theirs instead of being re-parsed. The
+        # indexes below are still rebuilt in full from it: BM25 and TF-IDF weights depend on every row.
+        reusable = {}
+        if previous is not None:
+            reusable = {id(college): data for college, data in zip(previous.colleges, previous.row_data)}
+        self.row_data = [reusable.get(id(college)) or self._derive(college) for college in colleges]
+        self.reparsed = self.size - sum(id(college) in reusable for college in colleges)
+
+        # Lowercase every searchable column once per load instead of once per request
+        self.columns = {
+            column: np.array([data[0][i] for data in self.row_data], dtype=object)
+            for i, column in enumerate(self.LOWERED_COLUMNS)
+        }
+
+        # Inverted index: column -> token -> sorted row ids containing that token
+        self.postings = {
+            column: self._build_postings([data[1][i] for data in self.row_data])
+            for i, column in enumerate(self.TEXT_COLUMNS)
+        }
+        self._expansions = {column: {} for column in self.TEXT_COLUMNS}
+
+        self.course_table = CourseTable([data[2] for data in self.row_data])
+
+        # Free-text BM25 index over every field of every college
+        self.text_index = BM25Index([data[3] for data in self.row_data])
+
+        # College ID and name lookups, and the "colleges like X" similarity index. IDs are not
+        # unique in the spreadsheet (missing ones read as 'nan'), so an ID maps to all its rows.
+        self.rows_by_id = {}
+        for row, college in enumerate(colleges):
+            self.rows_by_id.setdefault(college.college_id, []).append(row)
+        self.name_postings = {}
+        self.name_token_counts = np.zeros(self.size, dtype=np.int16)
+        for row, college in enumerate(colleges):
+            name_tokens = set(tokenize(college.name)) - GENERIC_NAME_WORDS
+            self.name_token_counts[row] = len(name_tokens)
+            for token in name_tokens:
+                self.name_postings.setdefault(token, []).append(row)
+        self.similarity_index = SimilarityIndex([self._similarity_features(row) for row in range(self.size)])
+
+    @classmethod
+    def _derive(cls, college) -> Tuple:
+        lowered = {column: getattr(college, column).lower() for column in cls.TEXT_COLUMNS}
+        # Interned, so a word shared by many colleges is stored once rather than once per college
+        tokens = tuple(frozenset(map(sys.intern, tokenize(lowered[column]))) for column in cls.TEXT_COLUMNS)
+        term_counts = dict(Counter(map(sys.intern, search_tokens(' '.join(college.to_dict().values())))))
+        kept = tuple(lowered[column] for column in cls.LOWERED_COLUMNS)
+        return kept, tokens, parse_courses(college.courses), term_counts
+
+    def _similarity_features(self, row: int) -> List[str]:
+        """Course, level, type, location and fee features describing one college"""
+        _, (location_tokens, type_tokens, _), courses, _ = self.row_data[row]
+        features = [f'loc:{token}' for token in location_tokens if not token.isdigit()]
+        features += [f'type:{token}' for token in type_tokens]
+        for code, level, _, _ in courses:
+            if code:
+                features.append(f'course:{code}')
+            if level != UNKNOWN_LEVEL:
+                features.append(f'level:{LEVELS[level]}')
+        min_fee = self.course_table.min_fee[row]
+        if not np.isnan(min_fee):
+            bucket = next((i for i, bound in enumerate(FEE_BUCKETS) if min_fee <= bound), len(FEE_BUCKETS))
+            features.append(f'fee:{bucket}')
+        return features
+
+    @staticmethod
+    def _build_postings(token_sets: List[frozenset]) -> Dict[str, np.ndarray]:
+        """Map every token of a column to the rows it appears in"""
+        postings = {}
+        for row, tokens in enumerate(token_sets):
+            for token in tokens:
+                postings.setdefault(token, []).append(row)
+        return {token: np.array(rows, dtype=np.int32) for token, rows in postings.items()}
+
+    def _token_rows(self, column: str, query_token: str) -> np.ndarray:
+        """Rows having a token that contains query_token (substring semantics)"""
+        cache = self._expansions[column]
+        rows = cache.get(query_token)
+        if rows is None:
+            postings = self.postings[column]
+            matches = [postings[token] for token in postings if query_token in token]
+            rows = np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int32)
+            if len(cache) >= MAX_EXPANSION_CACHE:
+                cache.clear()
+            cache[query_token] = rows
+        return rows
+
+    def match(self, column: str, term: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sorted ids of colleges whose column contains the given term, optionally limited to rows"""
+        term = term.lower()
+        query_tokens = tokenize(term)
+        if query_tokens:
+            # Every token of a substring lies inside some token of the text, so the
+            # posting intersection is a superset of the real matches
+            candidates = rows
+            for token in sorted(set(query_tokens), key=len, reverse=True):
+                token_rows = self._token_rows(column, token)
+                candidates = token_rows if candidates is None else np.intersect1d(candidates, token_rows, assume_unique=True)
+                if not len(candidates):
+                    return candidates
+        else:
+            candidates = np.arange(self.size, dtype=np.int32) if rows is None else rows
+
+        # Verify the exact substring only on the remaining candidates
+        values = self.columns.get(column)
+        if values is None:
+            return np.array([row for row in candidates if term in getattr(self.colleges[row], column).lower()],
+                            dtype=np.int32)
+        return np.array([row for row in candidates if term in values[row]], dtype=np.int32)
+
+    def match_any(self, column: str, terms: List[str], rows: Optional[np.ndarray] = None) -> Dict[int, int]:
+        """Map each matching row id to the index of the first term found in its column"""
+        matched = {}
+        for i, term in enumerate(terms):
+            for row in self.match(column, term, rows):
+                matched.setdefault(int(row), i)
+        return matched
+
+    def similar(self, row: int, k: int = 5) -> List[Tuple[int, float]]:
+        """Precomputed neighbours of a college as (row, similarity) pairs"""
+        return self.similarity_index.similar(row, k)
+
+    def find_mentioned_college(self, text: str) -> Optional[int]:
+        """Row of the college whose name the text mentions best, if any.
+
+        A name counts as mentioned when at least half of its distinctive words
+        (not "college", "university", ...) appear in the text, and at least one
+        of the matched words is not a place name, so "Pune" alone is not
+        "University of Pune".
+        """
+        matched = Counter()
+        distinctive = Counter()  # matched words that are not also place names
+        places = self.postings['location']
+        for token in set(tokenize(text)) - GENERIC_NAME_WORDS:
+            rows = self.name_postings.get(token, ())
+            matched.update(rows)
+            if token not in places:
+                distinctive.update(rows)
+        best, best_key = None, (0.0, 0, 0)
+        for row, count in matched.items():
+            if not distinctive[row]:
+                continue
+            key = (count / self.name_token_counts[row], distinctive[row], count)
+            if key > best_key:
+                best, best_key = row, key
+        return best if best_key[0] >= 0.5 else None
+
+    def search(self, query: str, k: int = 10, rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top k (row, BM25 score) pairs for a free-text query"""
+        return self.text_index.search(search_tokens(query), k, rows)
+
+    def search_terms(self, query: str) -> List[str]:
+        """The query's search tokens that occur in the catalog, as used for scoring"""
+        return self.text_index.known_terms(search_tokens(query))
+
+    def match_courses(self, terms: List[str], rows: Optional[np.ndarray] = None) -> Dict[int, int]:
+        """Like match_any on the courses column, also accepting parsed course codes (BTech == B.Tech)"""
+        matched = {}
+        for i, term in enumerate(terms):
+            offering = self.course_table.colleges_offering(term)
+            if rows is not None:
+                offering = np.intersect1d(offering, rows, assume_unique=True)
+            for row in np.union1d(self.match('courses', term, rows), offering):
+                matched.setdefault(int(row), i)
+        return matched
+
+    def match_level(self, level: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sorted ids of colleges offering the given level, falling back to text search"""
+        level_index = normalize_level(level)
+        if level_index is None:
+            return self.match('courses', level, rows)
+        level_rows = self.course_table.colleges_with_level(level_index)
+        return level_rows if rows is None else np.intersect1d(level_rows, rows, assume_unique=True)
+
+
+def file_fingerprint(path: str, with_hash: bool = True) -> Dict:
+    """Modification time, size and (optionally) SHA-256 of a file"""
+    stat = os.stat(path)
+    fingerprint = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+
+def _write_snapshot(snapshot_path: str, header: Dict, write_body):
+    """Atomically replace the snapshot with the header followed by what write_body(f) writes"""
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            write_body(f)
+        # Atomic rename so concurrently starting workers never read a partial file
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def save_catalog_snapshot(snapshot_path: str, source_path: str, catalog: CollegeCatalog):
+    """Write the built catalog next to its source so later processes can skip the Excel parse"""
+    header = {'version': SNAPSHOT_VERSION, 'source': file_fingerprint(source_path)}
+    _write_snapshot(snapshot_path, header, lambda f: pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_catalog_snapshot(snapshot_path: str, source_path: str) -> Optional[CollegeCatalog]:
+    """Load a catalog snapshot if it was built from the current source file, else None"""
+    if not os.path.exists(snapshot_path) or not os.path.exists(source_path):
+        return None
+
+    with open(snapshot_path, 'rb') as f:
+        header = pickle.load(f)
+        if header.get('version') != SNAPSHOT_VERSION:
+            return None
+
+        expected = header['source']
+        current = file_fingerprint(source_path, with_hash=False)
+        touched = (current['mtime_ns'], current['size']) != (expected['mtime_ns'], expected['size'])
+        if touched:
+            # The file was touched; only rebuild if its content actually changed
+            current = file_fingerprint(source_path)
+            if current['sha256'] != expected['sha256']:
+                return None
+
+        body_offset = f.tell()
+        catalog = pickle.load(f)
+        if touched:
+            # Same content under a new mtime (e.g. a fresh checkout): record it so later starts
+            # skip the hash. The body is copied from this open file, which another worker may
+            # have replaced on disk meanwhile.
+            try:
+                f.seek(body_offset)
+                _write_snapshot(snapshot_path, {**header, 'source': current}, lambda out: shutil.copyfileobj(f, out))
+            except OSError as e:
+                print(f"Error refreshing catalog snapshot header: {e}")
+        return catalog
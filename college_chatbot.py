@@ -1,31 +1,77 @@
 import os
+import sys
 import json
+import zlib
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 import sqlite3
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field, replace
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
 from langchain.chains import LLMChain
-from langchain.output_parsers import PydanticOutputParser, OutputFixingParser
+from langchain.output_parsers import PydanticOutputParser
 from langchain.schema import OutputParserException
 from pydantic import BaseModel, Field
 import re
+import hashlib
+import threading
 import openai
 from dotenv import load_dotenv
 import os
 
 # Import the enhanced database manager
 from enhanced_college_chatbot import EnhancedDatabaseManager
+from college_catalog import CollegeCatalog, parse_budget, load_catalog_snapshot, save_catalog_snapshot
+from cache_utils import SQLiteCache, TTLCache, llm_cache_key
+from intent_classifier import IntentClassifier
+from preference_extractor import PreferenceExtraction, PreferenceExtractor
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DB_PATH = os.getenv("DB_PATH")
 EXCEL_PATH = os.getenv("EXCEL_PATH")
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH")
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "10"))
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "0")) or None  # default: one per CPU
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+DB_MAINTENANCE_INTERVAL = float(os.getenv("DB_MAINTENANCE_INTERVAL", "3600"))  # seconds, 0 disables
+CHAT_ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "7"))
+CHAT_COMPRESS_AFTER_DAYS = float(os.getenv("CHAT_COMPRESS_AFTER_DAYS", "30"))
+INTENT_FAST_PATH_CONFIDENCE = float(os.getenv("INTENT_FAST_PATH_CONFIDENCE", "0.85"))
+INTENT_TRAINING_TURNS = int(os.getenv("INTENT_TRAINING_TURNS", "5000"))  # 0 keeps the hand-written weights
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite")  # sqlite or memory
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")  # default: <DB_PATH without extension>.llm_cache.db
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "10000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+
+# Absolute BM25 scores for the free-text bonus: below the minimum a match earns nothing,
+# at the full score it earns all 10 points
+TEXT_RELEVANCE_MIN = 1.0
+TEXT_RELEVANCE_FULL = 8.0
+
+# "colleges like X", "something similar to X", ... but not the verb in "I would like colleges in Pune"
+SIMILAR_COLLEGE_PATTERN = re.compile(
+    r'\b(?:(?:colleges?|universit(?:y|ies)|institut(?:e|es|ion|ions)|schools?|ones|options|something|anything)'
+    r'\s+(?:just\s+)?(?:like|such as)|similar to|same as|comparable to|alternatives? to)\b(.+)',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Openings of the replies chat() gives to recommendation requests; labels logged turns for the intent classifier
+RECOMMENDATION_REPLY_PREFIXES = (
+    "Here are colleges similar to",
+    "I don't have specific colleges for",
+    "I apologize, but I couldn't find specific college recommendations",
+    "Let me suggest some colleges",
+    "I need more specific information about your preferences",
+    "Based on your preferences, here are",
+)
 
 class UserPreferences(BaseModel):
     """User preferences extracted from conversation using LangChain"""
@@ -37,6 +83,26 @@ class UserPreferences(BaseModel):
     budget_range: Optional[str] = Field(None, description="Budget preference like low, medium, high")
     specific_course: Optional[str] = Field(None, description="Specific course like BTech, MBA, MBBS, etc.")
 
+class TurnAnalysis(BaseModel):
+    """Preference changes and intent of a single user message, extracted in one LLM call"""
+    preference_changes: UserPreferences = Field(description="Only the preferences the current message states or changes; null for every other field")
+    removed_preferences: List[str] = Field(default_factory=list, description="Names of stored preference fields the user withdraws in the current message")
+    wants_recommendations: bool = Field(description="True if the current message asks for college recommendations or suggestions")
+
+def merge_preferences(stored: UserPreferences, changes: UserPreferences, removed: List[str] = ()) -> UserPreferences:
+    """Apply a preference delta: stated fields overwrite, removed fields are cleared, the rest is kept"""
+    merged = {}
+    for name, value in stored.dict().items():
+        change = getattr(changes, name)
+        change = change.strip() if isinstance(change, str) else change
+        if name in removed:
+            merged[name] = None
+        elif change:
+            merged[name] = change
+        else:
+            merged[name] = value
+    return UserPreferences(**merged)
+
 class CollegeRecommendation(BaseModel):
     """College recommendation with reasoning"""
     college_name: str = Field(description="Name of the college")
@@ -44,131 +110,469 @@ class CollegeRecommendation(BaseModel):
     match_reasons: List[str] = Field(description="Reasons why this college matches user preferences")
     missing_criteria: List[str] = Field(description="Criteria that this college doesn't meet")
 
-@dataclass
 class College:
-    college_id: str
-    name: str
-    type: str
-    affiliation: str
-    location: str
-    website: str
-    contact: str
-    email: str
-    courses: str
-    scholarship: str
-    admission_process: str
+    """A college row, stored compactly.
+
+    Instances use __slots__, values repeated across colleges (type, affiliation)
+    are interned, and the long free-text fields are kept as UTF-8 bytes
+    (zlib-compressed when that is smaller) that are only decoded when read.
+    """
+    FIELDS = ('college_id', 'name', 'type', 'affiliation', 'location', 'website', 'contact', 'email',
+              'courses', 'scholarship', 'admission_process')
+    INTERNED_FIELDS = ('type', 'affiliation')
+    PACKED_FIELDS = ('courses', 'scholarship', 'admission_process')
+    
+    __slots__ = ('college_id', 'name', 'type', 'affiliation', 'location', 'website', 'contact', 'email',
+                 '_courses', '_scholarship', '_admission_process')
+    
+    def __init__(self, college_id: str, name: str, type: str, affiliation: str, location: str, website: str,
+                 contact: str, email: str, courses: str, scholarship: str, admission_process: str):
+        self.college_id = college_id
+        self.name = name
+        self.type = sys.intern(type)
+        self.affiliation = sys.intern(affiliation)
+        self.location = location
+        self.website = website
+        self.contact = contact
+        self.email = email
+        self._courses = self._pack(courses)
+        self._scholarship = self._pack(scholarship)
+        self._admission_process = self._pack(admission_process)
+    
+    @staticmethod
+    def _pack(text: str) -> bytes:
+        # The first byte records whether the payload is compressed
+        raw = text.encode('utf-8')
+        compressed = zlib.compress(raw, 9)
+        return b'z' + compressed if len(compressed) < len(raw) else b'r' + raw
+    
+    @staticmethod
+    def _unpack(packed: bytes) -> str:
+        raw = zlib.decompress(packed[1:]) if packed[:1] == b'z' else packed[1:]
+        return raw.decode('utf-8')
+    
+    @property
+    def courses(self) -> str:
+        return self._unpack(self._courses)
+    
+    @property
+    def scholarship(self) -> str:
+        return self._unpack(self._scholarship)
+    
+    @property
+    def admission_process(self) -> str:
+        return self._unpack(self._admission_process)
+    
+    def to_dict(self) -> Dict[str, str]:
+        """All fields as a plain dict, decoding the packed text fields"""
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+    
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+        # Interning does not survive pickling
+        for name in self.INTERNED_FIELDS:
+            setattr(self, name, sys.intern(getattr(self, name)))
+    
+    def __eq__(self, other):
+        if not isinstance(other, College):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"College(college_id={self.college_id!r}, name={self.name!r})"
+
+@dataclass
+class CollegeRanking:
+    """Scored colleges for one set of preferences; pages are cut from it without re-scoring"""
+    catalog: CollegeCatalog
+    preferences: UserPreferences
+    rows: np.ndarray
+    scores: np.ndarray
+    course_terms: List[str]
+    matched_course: Dict[int, int]
+    level_match: np.ndarray
+    budget_match: np.ndarray
+    text_bonus: np.ndarray
+    search_terms: List[str]
+    _order: Optional[np.ndarray] = field(default=None, repr=False)
+    
+    @property
+    def total(self) -> int:
+        return len(self.rows)
+    
+    def _top(self, n: int) -> np.ndarray:
+        """Positions of the n best scores, ties kept in catalog order"""
+        if self._order is None or (len(self._order) < n and len(self._order) < self.total):
+            # Grow the sorted prefix geometrically so paging forward stays cheap
+            size = min(self.total, max(n, 2 * len(self._order) if self._order is not None else n))
+            key = -self.scores.astype(np.int64) * max(self.total, 1) + np.arange(self.total)
+            top = np.argpartition(key, size - 1)[:size] if size < self.total else np.arange(self.total)
+            self._order = top[np.argsort(key[top])]
+        return self._order[:n]
+    
+    def page(self, k: int = 3, offset: int = 0) -> List[Dict]:
+        """Match dicts for ranks offset .. offset + k"""
+        if k <= 0 or offset >= self.total:
+            return []
+        return [self._match(i) for i in self._top(offset + k)[offset:]]
+    
+    def _match(self, i: int) -> Dict:
+        preferences = self.preferences
+        row = self.rows[i]
+        match_reasons = []
+        if preferences.location:
+            match_reasons.append(f"Located in {preferences.location}")
+        if preferences.college_type:
+            match_reasons.append(f"Matches college type: {preferences.college_type}")
+        if self.course_terms:
+            match_reasons.append(f"Offers {self.course_terms[self.matched_course[int(row)]]} courses")
+        if self.level_match[i]:
+            match_reasons.append(f"Offers {preferences.level} programs")
+        if self.budget_match[i]:
+            match_reasons.append(f"Fees within budget ({preferences.budget_range})")
+        if self.text_bonus[i]:
+            term_counts = self.catalog.row_data[row][3]
+            matched_terms = [term for term in self.search_terms if term in term_counts]
+            match_reasons.append(f"Mentions {', '.join(matched_terms)}")
+        
+        return {
+            'college': self.catalog.colleges[row],
+            'score': int(self.scores[i]),
+            'reasons': match_reasons,
+            'missing': []
+        }
 
 class CollegeDataManager:
-    def __init__(self, excel_path: str):
+    def __init__(self, excel_path: str, snapshot_path: str = None, reload_interval: float = None,
+                 cache_size: int = 1024, cache_ttl: float = 600):
         self.excel_path = excel_path
-        self.colleges = self.load_college_data()
+        self.snapshot_path = snapshot_path or CATALOG_SNAPSHOT_PATH
+        if not self.snapshot_path and excel_path:
+            self.snapshot_path = os.path.splitext(excel_path)[0] + '.catalog.pkl'
+        self.reload_interval = CATALOG_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        
+        self._reload_lock = threading.Lock()
+        self._stop_watching = threading.Event()
+        self._watcher = None
+        
+        # Rankings keyed by (catalog version, preferences hash)
+        self._ranking_cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        
+        # Rule-based preference extraction over the catalog's places and courses
+        self.preference_extractor = PreferenceExtractor()
+        
+        self._source_state = self._get_source_state()
+        self.catalog = self.load_catalog()
+        
+        if self.reload_interval > 0 and excel_path:
+            self.start_watching()
+    
+    @property
+    def colleges(self) -> List[College]:
+        """Colleges of the current catalog version"""
+        return self.catalog.colleges
+    
+    def load_catalog(self) -> CollegeCatalog:
+        """Load the catalog from its binary snapshot, rebuilding it from Excel when stale"""
+        if self.snapshot_path and self.excel_path:
+            try:
+                catalog = load_catalog_snapshot(self.snapshot_path, self.excel_path)
+                if catalog is not None:
+                    print(f"Loaded {catalog.size} colleges from catalog snapshot")
+                    return catalog
+            except Exception as e:
+                print(f"Error loading catalog snapshot: {e}")
+        
+        colleges = self.load_college_data()
+        catalog = CollegeCatalog(colleges)
+        
+        if colleges:
+            self._save_snapshot(catalog)
+        return catalog
+    
+    def _save_snapshot(self, catalog: CollegeCatalog):
+        if not self.snapshot_path:
+            return
+        try:
+            save_catalog_snapshot(self.snapshot_path, self.excel_path, catalog)
+        except Exception as e:
+            print(f"Error saving catalog snapshot: {e}")
     
     def load_college_data(self) -> List[College]:
         """Load college data from Excel file"""
         try:
-            df = pd.read_excel(self.excel_path)
-            colleges = []
-            
-            for _, row in df.iterrows():
-                college = College(
-                    college_id=str(row.get('College ID', '')),
-                    name=str(row.get('College', '')),
-                    type=str(row.get('Type', '')),
-                    affiliation=str(row.get('Affiliation', '')),
-                    location=str(row.get('Location', '')),
-                    website=str(row.get('Website', '')),
-                    contact=str(row.get('Contact', '')),
-                    email=str(row.get('E-mail', '')),
-                    courses=str(row.get('Courses (ID, Category, Duration, Eligibility, Language, Accreditation, Fees)', '')),
-                    scholarship=str(row.get('Scholarship', '')),
-                    admission_process=str(row.get('Admission Process', ''))
-                )
-                colleges.append(college)
-            
+            colleges = self.read_college_data()
             print(f"Loaded {len(colleges)} colleges from Excel file")
             return colleges
         except Exception as e:
             print(f"Error loading Excel data: {e}")
             return []
     
-    def filter_colleges_by_preferences(self, preferences: UserPreferences) -> List[Dict]:
-        """Filter colleges based on user preferences with strict matching"""
-        matching_colleges = []
+    def read_college_data(self) -> List[College]:
+        """Read every row of the Excel file, raising if it cannot be parsed"""
+        df = pd.read_excel(self.excel_path)
+        colleges = []
         
-        for college in self.colleges:
-            match_score = 0
-            match_reasons = []
-            missing_criteria = []
-            
-            # Location filtering (strict)
-            location_match = False
-            if preferences.location:
-                location_terms = [preferences.location.lower()]
-                if preferences.state:
-                    location_terms.append(preferences.state.lower())
-                
-                college_location = college.location.lower()
-                for term in location_terms:
-                    if term in college_location:
-                        location_match = True
-                        match_score += 30
-                        match_reasons.append(f"Located in {preferences.location}")
-                        break
-                
-                if not location_match:
-                    missing_criteria.append(f"Not in preferred location: {preferences.location}")
-                    continue  # Skip this college if location doesn't match
+        for row in df.to_dict('records'):
+            college = College(
+                college_id=str(row.get('College ID', '')),
+                name=str(row.get('College', '')),
+                type=str(row.get('Type', '')),
+                affiliation=str(row.get('Affiliation', '')),
+                location=str(row.get('Location', '')),
+                website=str(row.get('Website', '')),
+                contact=str(row.get('Contact', '')),
+                email=str(row.get('E-mail', '')),
+                courses=str(row.get('Courses (ID, Category, Duration, Eligibility, Language, Accreditation, Fees)', '')),
+                scholarship=str(row.get('Scholarship', '')),
+                admission_process=str(row.get('Admission Process', ''))
+            )
+            colleges.append(college)
+        
+        return colleges
+    
+    def _get_source_state(self):
+        try:
+            stat = os.stat(self.excel_path)
+            return stat.st_mtime_ns, stat.st_size
+        except (OSError, TypeError):
+            return None
+    
+    @staticmethod
+    def _college_keys(colleges: List[College]) -> List[tuple]:
+        """Diff keys by College ID; repeated or missing IDs are told apart by occurrence"""
+        seen = {}
+        keys = []
+        for college in colleges:
+            occurrence = seen.get(college.college_id, 0)
+            seen[college.college_id] = occurrence + 1
+            keys.append((college.college_id, occurrence))
+        return keys
+    
+    def reload_catalog(self) -> bool:
+        """Re-read the Excel file and swap in a new catalog version if anything changed.
+
+        Only changed rows are re-parsed, but every index is rebuilt, so this
+        is a full re-index (a few seconds at tens of thousands of rows). It
+        runs on the watcher thread, off the request path.
+        """
+        with self._reload_lock:
+            source_state = self._get_source_state()
+            colleges = self.read_college_data()
+            current = self.catalog
             
-            # College type filtering (strict)
-            if preferences.college_type:
-                if preferences.college_type.lower() in college.type.lower():
-                    match_score += 25
-                    match_reasons.append(f"Matches college type: {preferences.college_type}")
+            # Unchanged rows keep their College object so the catalog reuses their parsed data
+            previous = dict(zip(self._college_keys(current.colleges), current.colleges))
+            merged = []
+            changed = 0
+            for key, college in zip(self._college_keys(colleges), colleges):
+                old = previous.pop(key, None)
+                if old is not None and old == college:
+                    merged.append(old)
                 else:
-                    missing_criteria.append(f"Not a {preferences.college_type} college")
-                    continue  # Skip if type doesn't match
+                    merged.append(college)
+                    changed += 1
+            removed = len(previous)
             
-            # Course type filtering (strict)
-            course_match = False
-            if preferences.course_type or preferences.specific_course:
-                college_courses = college.courses.lower()
-                
-                if preferences.specific_course:
-                    course_terms = [preferences.specific_course.lower()]
-                    if preferences.course_type:
-                        course_terms.append(preferences.course_type.lower())
-                else:
-                    course_terms = [preferences.course_type.lower()]
-                
-                for term in course_terms:
-                    if term in college_courses:
-                        course_match = True
-                        match_score += 25
-                        match_reasons.append(f"Offers {term} courses")
-                        break
-                
-                if not course_match:
-                    missing_criteria.append(f"Doesn't offer preferred course type")
-                    continue  # Skip if course doesn't match
+            self._source_state = source_state
+            if len(merged) == current.size and all(a is b for a, b in zip(merged, current.colleges)):
+                return False
             
-            # Level filtering
-            if preferences.level:
-                if preferences.level.lower() in college.courses.lower():
-                    match_score += 10
-                    match_reasons.append(f"Offers {preferences.level} programs")
+            catalog = CollegeCatalog(merged, version=current.version + 1, previous=current)
+            # A single reference swap: requests holding the old catalog finish on it consistently
+            self.catalog = catalog
+            self._ranking_cache.clear()
+            print(f"Reloaded college catalog v{catalog.version}: {changed} added or changed, "
+                  f"{removed} removed, {catalog.reparsed} re-parsed")
+        
+        self._save_snapshot(catalog)
+        return True
+    
+    def start_watching(self):
+        """Poll the Excel file in the background and hot-reload it when it changes"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, name='college-data-watcher', daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        """Stop the background file watcher"""
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+    
+    def _watch(self):
+        while not self._stop_watching.wait(self.reload_interval):
+            if self._get_source_state() == self._source_state:
+                continue
+            try:
+                self.reload_catalog()
+            except Exception as e:
+                # Most likely the file is still being written; retry on the next poll
+                print(f"Error reloading college data: {e}")
+    
+    def filter_colleges_by_preferences(self, preferences: UserPreferences, k: int = 3, offset: int = 0,
+                                       query: str = None) -> List[Dict]:
+        """Filter colleges based on user preferences with strict matching, returning the top k after offset"""
+        return self.rank_colleges(preferences, query).page(k, offset)
+    
+    def similar_rows(self, row: int, k: int = 5, catalog: CollegeCatalog = None) -> List[Dict]:
+        """Colleges most similar to the one at the given row of the catalog"""
+        catalog = catalog or self.catalog
+        name = catalog.colleges[row].name
+        return [
+            {
+                'college': catalog.colleges[neighbor],
+                'score': int(round(similarity * 100)),
+                'reasons': [f"Similar to {name} in courses, type, location and fees"],
+                'missing': []
+            }
+            for neighbor, similarity in catalog.similar(row, k)
+        ]
+    
+    def find_liked_college(self, text: str, catalog: CollegeCatalog = None) -> Optional[int]:
+        """Catalog row of the college a message names as one the user likes, e.g. "colleges like Christ University" """
+        match = SIMILAR_COLLEGE_PATTERN.search(text)
+        if not match:
+            return None
+        return (catalog or self.catalog).find_mentioned_college(match.group(1))
+    
+    def extract_preferences(self, text: str, stored: Dict = None) -> PreferenceExtraction:
+        """Preference changes in a message, read with the gazetteer and course lexicon of the current catalog"""
+        return self.preference_extractor.extract(self.catalog, text, stored)
+    
+    def search_colleges(self, query: str, k: int = 10) -> List[Dict]:
+        """Free-text BM25 search over every college field"""
+        catalog = self.catalog
+        return [
+            {'college': catalog.colleges[row], 'score': round(score, 3)}
+            for row, score in catalog.search(query, k)
+        ]
+    
+    @staticmethod
+    def normalize_preferences(preferences: UserPreferences) -> UserPreferences:
+        """Copy of the preferences with surrounding and repeated whitespace removed"""
+        normalized = {}
+        for name, value in preferences.dict().items():
+            if isinstance(value, str):
+                value = ' '.join(value.split()) or None
+            normalized[name] = value
+        return UserPreferences(**normalized)
+    
+    @staticmethod
+    def preferences_key(preferences: UserPreferences) -> str:
+        """Canonical hash of normalized preferences, insensitive to case and whitespace"""
+        canonical = {
+            name: value.casefold() if isinstance(value, str) else value
+            for name, value in preferences.dict().items()
+        }
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def rank_colleges(self, preferences: UserPreferences, query: str = None) -> 'CollegeRanking':
+        """Rank colleges for the preferences, reusing a cached ranking for the same catalog version.
+        
+        Free-text query terms found in the catalog add up to 10 points of relevance
+        to colleges that already pass the preference filters.
+        """
+        catalog = self.catalog
+        preferences = self.normalize_preferences(preferences)
+        search_terms = catalog.search_terms(query) if query else []
+        key = (catalog.version, self.preferences_key(preferences), tuple(search_terms))
+        
+        ranking = self._ranking_cache.get(key)
+        if ranking is None:
+            ranking = self._rank_colleges(catalog, preferences, search_terms)
+            self._ranking_cache.set(key, ranking)
+        elif ranking.preferences != preferences:
+            # Same ranking, but keep this request's wording in the match reasons
+            ranking = replace(ranking, preferences=preferences)
+        return ranking
+    
+    def _rank_colleges(self, catalog: CollegeCatalog, preferences: UserPreferences,
+                       search_terms: List[str]) -> 'CollegeRanking':
+        """Apply the strict preference filters and score every remaining college"""
+        candidates = None  # None means no strict criterion has narrowed the catalog yet
+        base_score = 0
+        
+        # Location filtering (strict)
+        if preferences.location:
+            location_terms = [preferences.location.lower()]
+            if preferences.state:
+                location_terms.append(preferences.state.lower())
+            
+            candidates = np.array(sorted(catalog.match_any('location', location_terms)), dtype=np.int32)
+            base_score += 30
+        
+        # College type filtering (strict)
+        if preferences.college_type:
+            candidates = catalog.match('type', preferences.college_type, candidates)
+            base_score += 25
+        
+        # Course type filtering (strict)
+        course_terms = []
+        matched_course = {}
+        if preferences.course_type or preferences.specific_course:
+            if preferences.specific_course:
+                course_terms = [preferences.specific_course.lower()]
+                if preferences.course_type:
+                    course_terms.append(preferences.course_type.lower())
+            else:
+                course_terms = [preferences.course_type.lower()]
             
-            # Only add colleges that meet the strict criteria
-            if match_score > 0:
-                matching_colleges.append({
-                    'college': college,
-                    'score': match_score,
-                    'reasons': match_reasons,
-                    'missing': missing_criteria
-                })
-        
-        # Sort by match score
-        matching_colleges.sort(key=lambda x: x['score'], reverse=True)
-        return matching_colleges[:3]  # Return top 3 matches
+            matched_course = catalog.match_courses(course_terms, candidates)
+            candidates = np.array(sorted(matched_course), dtype=np.int32)
+            base_score += 25
+        
+        # Budget filtering: drop colleges whose cheapest known fee is over budget
+        budget_rows = np.zeros(0, dtype=np.int32)
+        max_fee = parse_budget(preferences.budget_range) if preferences.budget_range else None
+        if max_fee is not None:
+            budget_rows, over_budget = catalog.course_table.colleges_by_fee(max_fee)
+            if candidates is not None:
+                candidates = np.setdiff1d(candidates, over_budget, assume_unique=True)
+        
+        # Level filtering
+        level_rows = np.zeros(0, dtype=np.int32)
+        if preferences.level:
+            level_rows = catalog.match_level(preferences.level, candidates)
+        
+        if candidates is None:
+            # Level and budget alone are enough to score a college
+            candidates = np.union1d(level_rows, budget_rows).astype(np.int32)
+        
+        level_match = np.isin(candidates, level_rows)
+        budget_match = np.isin(candidates, budget_rows)
+        scores = base_score + 10 * level_match + 10 * budget_match
+        
+        # Free-text relevance on an absolute scale, so weak matches are not inflated just
+        # because nothing better is among the candidates
+        text_bonus = np.zeros(len(candidates), dtype=np.int64)
+        if search_terms and len(candidates):
+            relevance = catalog.text_index.score(search_terms)[candidates]
+            scaled = np.rint(10 * np.minimum(relevance / TEXT_RELEVANCE_FULL, 1.0)).astype(np.int64)
+            text_bonus = np.where(relevance >= TEXT_RELEVANCE_MIN, scaled, 0)
+        scores = scores + text_bonus
+        
+        return CollegeRanking(
+            catalog=catalog,
+            preferences=preferences,
+            rows=candidates,
+            scores=scores,
+            course_terms=course_terms,
+            matched_course=matched_course,
+            level_match=level_match,
+            budget_match=budget_match,
+            text_bonus=text_bonus,
+            search_terms=search_terms
+        )
 
 class EnhancedCollegeRecommendationChatbot:
     def __init__(self, api_key: str, excel_path: str, db_path: str):
@@ -181,16 +585,33 @@ class EnhancedCollegeRecommendationChatbot:
             openai_api_key=api_key
         )
         
-        self.db_manager = EnhancedDatabaseManager(db_path)
+        self.db_manager = EnhancedDatabaseManager(
+            db_path,
+            write_behind=DB_WRITE_BEHIND,
+            bcrypt_rounds=BCRYPT_ROUNDS,
+            bcrypt_workers=BCRYPT_WORKERS,
+            bcrypt_max_pending=BCRYPT_MAX_PENDING,
+            maintenance_interval=DB_MAINTENANCE_INTERVAL,
+            archive_after_days=CHAT_ARCHIVE_AFTER_DAYS,
+            compress_after_days=CHAT_COMPRESS_AFTER_DAYS
+        )
         self.data_manager = CollegeDataManager(excel_path)
+        
+        # Answers to repeated OpenAI calls (recommendations, chat titles), kept across restarts
+        if LLM_CACHE_BACKEND == "memory":
+            self.llm_cache = TTLCache(max_size=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+        else:
+            cache_path = LLM_CACHE_PATH or os.path.splitext(db_path)[0] + '.llm_cache.db'
+            self.llm_cache = SQLiteCache(cache_path, max_size=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
         self.conversation_chains = {}  # Store conversation chains per session
         
-        # Initialize preference extraction chain
-        self.preference_parser = PydanticOutputParser(pydantic_object=UserPreferences)
-        self.preference_chain = self._create_preference_extraction_chain()
+        # Preferences and recommendation intent come from one structured call per turn
+        self.turn_parser = PydanticOutputParser(pydantic_object=TurnAnalysis)
+        self.turn_analysis_chain = self._create_turn_analysis_chain()
         
-        # Initialize recommendation detection chain
-        self.recommendation_detector = self._create_recommendation_detector()
+        # Local intent classifier; the LLM decides only the messages it is unsure about
+        self.intent_classifier = IntentClassifier(threshold=INTENT_FAST_PATH_CONFIDENCE)
+        self.train_intent_classifier()
         
         # Main conversation chain
         self.system_prompt = """
@@ -213,11 +634,13 @@ Key Guidelines:
 Remember: Wait for the user to ask for recommendations before providing them!
 """
     
-    def _create_preference_extraction_chain(self):
-        """Create chain for extracting user preferences using LangChain"""
-        preference_prompt = PromptTemplate(
+    def _create_turn_analysis_chain(self):
+        """Create chain extracting user preferences and recommendation intent in one call"""
+        analysis_prompt = PromptTemplate(
             template="""
-            Extract user preferences for college search from the following conversation history.
+            Analyze the current message of a college search conversation and do two things.
+
+            1. Report how the current message changes the user's stored preferences for college search.
             Look for mentions of:
             - Location/City/State (like "Indore", "MP", "Delhi", "Bangalore", etc.)
             - Course types (like "Engineering", "Medical", "Commerce", "Arts", "Management")
@@ -225,45 +648,32 @@ Remember: Wait for the user to ask for recommendations before providing them!
             - College types (like "Government", "Private", "Deemed")
             - Level (like "UG", "PG", "Undergraduate", "Postgraduate")
             - Budget preferences
+            Put only the fields the current message states or changes in preference_changes and use null
+            for every other field; do not repeat stored preferences. List in removed_preferences the names
+            of stored fields the user withdraws (e.g. "any location is fine" removes location).
+
+            2. Decide if the current message asks for college recommendations or suggestions.
+            Set wants_recommendations to true if the user asks for college recommendations, suggestions,
+            or wants to know about colleges, e.g. "recommend", "suggest", "which college", "best college",
+            "colleges for", "help me find", "looking for", "options", "where should I", "any suggestions".
+            Set it to false if they are just having a conversation or asking general questions.
 
-            Conversation History:
-            {conversation_history}
+            Stored Preferences:
+            {stored_preferences}
+
+            Fields to update: {fields}
+            Report changes for these fields only and use null for every other field.
 
             Current Message:
             {current_message}
 
             {format_instructions}
-
-            Extract preferences as JSON. If no clear preference is mentioned, use null for that field.
-            """,
-            input_variables=["conversation_history", "current_message"],
-            partial_variables={"format_instructions": self.preference_parser.get_format_instructions()}
-        )
-        
-        return LLMChain(llm=self.llm, prompt=preference_prompt)
-    
-    def _create_recommendation_detector(self):
-        """Create chain for detecting recommendation requests"""
-        detector_prompt = PromptTemplate(
-            template="""
-            Determine if the user is asking for college recommendations or suggestions.
-            
-            User message: "{message}"
-            
-            Return "YES" if the user is asking for college recommendations, suggestions, or wants to know about colleges.
-            Return "NO" if they are just having a conversation or asking general questions.
-            
-            Keywords that indicate recommendation request:
-            - "recommend", "suggest", "which college", "best college", "good college"
-            - "colleges for", "help me find", "looking for", "options"
-            - "where should I", "what colleges", "any suggestions"
-            
-            Answer with only YES or NO.
             """,
-            input_variables=["message"]
+            input_variables=["stored_preferences", "fields", "current_message"],
+            partial_variables={"format_instructions": self.turn_parser.get_format_instructions()}
         )
         
-        return LLMChain(llm=self.llm, prompt=detector_prompt)
+        return LLMChain(llm=self.llm, prompt=analysis_prompt)
     
     def create_conversation_chain(self, session_id: str, user_id: str):
         """Create a conversation chain with memory for a session"""
@@ -273,8 +683,8 @@ Remember: Wait for the user to ask for recommendations before providing them!
         )
         
         # Load previous messages
-        previous_messages = self.db_manager.get_session_messages(session_id, user_id)
-        for msg in previous_messages[-10:]:  # Load last 10 messages
+        previous_messages = self.db_manager.get_recent_messages(session_id, user_id, limit=10)
+        for msg in previous_messages:  # Load last 10 messages
             if msg['type'] == 'human':
                 memory.chat_memory.add_user_message(msg['content'])
             elif msg['type'] == 'ai':
@@ -296,66 +706,110 @@ Remember: Wait for the user to ask for recommendations before providing them!
         
         return conversation
     
-    def extract_preferences_with_llm(self, session_id: str, user_id: str, current_message: str) -> UserPreferences:
-        """Extract user preferences using LangChain"""
+    def train_intent_classifier(self):
+        """Fit the intent classifier on logged turns, labelled by the kind of reply they got"""
+        if not INTENT_TRAINING_TURNS:
+            return
         try:
-            # Get conversation history
-            messages = self.db_manager.get_session_messages(session_id, user_id)
-            conversation_history = "\n".join([
-                f"{msg['type'].title()}: {msg['content']}" for msg in messages[-10:]
-            ])
-            
-            # Extract preferences using LLM
-            result = self.preference_chain.run(
-                conversation_history=conversation_history,
-                current_message=current_message
-            )
-            
-            # Parse the result
-            try:
-                preferences = self.preference_parser.parse(result)
-                
-                # Save preferences to database
-                pref_dict = preferences.dict()
-                self.db_manager.save_preferences(session_id, user_id, pref_dict)
-                
-                return preferences
-            except OutputParserException as e:
-                print(f"Parser error: {e}")
-                # Try to fix the output
-                fixing_parser = OutputFixingParser.from_llm(parser=self.preference_parser, llm=self.llm)
-                preferences = fixing_parser.parse(result)
-                return preferences
-                
+            turns = self.db_manager.get_logged_turns(INTENT_TRAINING_TURNS)
+            texts = [message for message, reply in turns]
+            labels = [reply.startswith(RECOMMENDATION_REPLY_PREFIXES) for message, reply in turns]
+            if self.intent_classifier.fit(texts, labels):
+                print(f"Intent classifier trained on {len(turns)} logged turns")
         except Exception as e:
-            print(f"Error extracting preferences: {e}")
-            # Return previous preferences if available
-            prev_prefs = self.db_manager.get_preferences(session_id, user_id)
-            if prev_prefs:
-                return UserPreferences(**prev_prefs)
-            return UserPreferences()
+            print(f"Error training intent classifier: {e}")
     
-    def is_asking_for_recommendations(self, user_input: str) -> bool:
-        """Use LangChain to detect recommendation requests"""
+    def analyze_turn(self, session_id: str, user_id: str, current_message: str) -> Tuple[UserPreferences, bool]:
+        """Update the stored preferences with the current message and detect recommendation intent"""
+        # Confident local decisions override the model; ambiguous messages keep its answer
+        local_intent, confidence = self.intent_classifier.classify(current_message)
+        prev_prefs = self.db_manager.get_preferences(session_id, user_id)
+        stored = UserPreferences(**prev_prefs) if prev_prefs else UserPreferences()
+        
+        # The rules settle most mentions; the LLM is asked only about what they could not
+        extraction = self.data_manager.extract_preferences(current_message, stored.dict())
+        preferences = merge_preferences(stored, UserPreferences(**extraction.changes), extraction.removed)
+        wants_recommendations = local_intent
+        
+        if extraction.unresolved or local_intent is None:
+            try:
+                # Only the new message and the current state go to the model, which answers with a delta
+                preferences_json = json.dumps({name: value for name, value in preferences.dict().items() if value})
+                result = self.turn_analysis_chain.run(
+                    stored_preferences=preferences_json,
+                    fields=', '.join(extraction.unresolved) or 'none',
+                    current_message=current_message
+                )
+                analysis = self.parse_turn_analysis(result)
+                changes = {
+                    name: value for name, value in analysis.preference_changes.dict().items()
+                    if name in extraction.unresolved
+                }
+                removed = [name for name in analysis.removed_preferences if name in extraction.unresolved]
+                preferences = merge_preferences(preferences, UserPreferences(**changes), removed)
+                if local_intent is None:
+                    wants_recommendations = analysis.wants_recommendations
+                    
+            except Exception as e:
+                print(f"Error analyzing turn: {e}")
+                # Keep what the rules found and fall back to the local classifier's best guess
+                if local_intent is None:
+                    wants_recommendations = self.is_asking_for_recommendations(current_message)
+        
+        # Save preferences to database
+        if preferences != stored:
+            self.db_manager.save_preferences(session_id, user_id, preferences.dict())
+        
+        return preferences, wants_recommendations
+    
+    def parse_turn_analysis(self, text: str) -> TurnAnalysis:
+        """Parse the analysis output, tolerating the usual ways the model drifts from the schema"""
         try:
-            result = self.recommendation_detector.run(message=user_input)
-            return "YES" in result.upper()
-        except Exception as e:
-            print(f"Error in recommendation detection: {e}")
-            # Fallback to keyword matching
-            recommendation_keywords = [
-                'recommend', 'suggest', 'colleges', 'universities', 'which college',
-                'best college', 'good college', 'college for', 'options for',
-                'where should i', 'help me find', 'looking for college', 'any college',
-                'colleges in', 'suggest college', 'show me college'
-            ]
-            
-            user_input_lower = user_input.lower()
-            return any(keyword in user_input_lower for keyword in recommendation_keywords)
+            return self.turn_parser.parse(text)
+        except OutputParserException as e:
+            print(f"Parser error: {e}")
+        
+        # Outermost JSON object, e.g. wrapped in prose or a code fence
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        if not match:
+            raise OutputParserException(f"No JSON object in turn analysis: {text!r}")
+        data = json.loads(match.group(0))
+        
+        # Preference fields under another name or at the top level
+        changes = data.get('preference_changes', data.get('preferences'))
+        if not isinstance(changes, dict):
+            changes = {name: data.get(name) for name in UserPreferences.__fields__}
+        changes = {
+            name: str(value) if value not in (None, '') else None
+            for name, value in changes.items() if name in UserPreferences.__fields__
+        }
+        removed = data.get('removed_preferences') or []
+        if isinstance(removed, str):
+            removed = [removed]
+        removed = [name for name in removed if name in UserPreferences.__fields__]
+        
+        # Intent as a bool, "YES"/"NO" or "true"/"false"
+        intent = data.get('wants_recommendations', data.get('intent', False))
+        if isinstance(intent, str):
+            intent = intent.strip().upper() in ('YES', 'TRUE', 'RECOMMEND', 'RECOMMENDATION')
+        
+        return TurnAnalysis(
+            preference_changes=UserPreferences(**changes),
+            removed_preferences=removed,
+            wants_recommendations=bool(intent)
+        )
+    
+    def is_asking_for_recommendations(self, user_input: str) -> bool:
+        """Local best guess whether the message asks for recommendations, however unsure"""
+        return self.intent_classifier.probability(user_input) >= 0.5
     
     def get_openai_college_recommendations(self, preferences: UserPreferences, location: str = None) -> List[Dict]:
         """Get college recommendations from OpenAI for specific locations"""
         try:
+            # Normalized so that equivalent preferences produce the same prompt and cache key
+            preferences = self.data_manager.normalize_preferences(preferences)
+            location = ' '.join(location.split()) if location else None
+            
             # Build preference description
             pref_parts = []
             if location:
@@ -393,6 +847,11 @@ Remember: Wait for the user to ask for recommendations before providing them!
             Return only the JSON array, no additional text.
             """
             
+            cache_key = llm_cache_key("gpt-3.5-turbo", {"temperature": 0.5}, prompt)
+            colleges = self.llm_cache.get(cache_key)
+            if colleges is not None:
+                return colleges
+            
             response = openai.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": prompt}],
@@ -402,42 +861,48 @@ Remember: Wait for the user to ask for recommendations before providing them!
             result = response.choices[0].message.content.strip()
             
             try:
-                return json.loads(result)
+                colleges = json.loads(result)
             except json.JSONDecodeError:
                 # Extract JSON if there's additional text
                 json_match = re.search(r'\[.*\]', result, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group())
-                return []
+                colleges = json.loads(json_match.group()) if json_match else []
+            
+            if colleges:
+                self.llm_cache.set(cache_key, colleges)
+            return colleges
                 
         except Exception as e:
             print(f"Error getting OpenAI recommendations: {e}")
             return []
     
+    def _database_recommendation(self, item: Dict) -> Dict:
+        """Recommendation entry for a college matched in the database"""
+        rec = item['college'].to_dict()
+        rec["match_score"] = item['score']
+        rec["match_reasons"] = item['reasons']
+        rec["source"] = "database"
+        return rec
+    
+    def get_recommendation_page(self, session_id: str, user_id: str, offset: int = 0, limit: int = 3) -> Dict:
+        """Page through database matches for the preferences saved on a chat session"""
+        preferences = UserPreferences(**self.db_manager.get_preferences(session_id, user_id))
+        ranking = self.data_manager.rank_colleges(preferences)
+        page = ranking.page(limit, offset)
+        next_offset = offset + len(page)
+        
+        return {
+            'recommendations': [self._database_recommendation(item) for item in page],
+            'total': ranking.total,
+            'next_offset': next_offset if next_offset < ranking.total else None
+        }
+    
     def format_college_recommendations(self, filtered_colleges: List[Dict], openai_colleges: List[Dict], preferences: UserPreferences) -> str:
         """Format college recommendations with detailed explanations"""
         recommendations = []
         
         # Add filtered colleges from database
         for item in filtered_colleges:
-            college = item['college']
-            rec = {
-                "college_id": college.college_id,
-                "name": college.name,
-                "type": college.type,
-                "affiliation": college.affiliation,
-                "location": college.location,
-                "website": college.website,
-                "contact": college.contact,
-                "email": college.email,
-                "courses": college.courses,
-                "scholarship": college.scholarship,
-                "admission_process": college.admission_process,
-                "match_score": item['score'],
-                "match_reasons": item['reasons'],
-                "source": "database"
-            }
-            recommendations.append(rec)
+            recommendations.append(self._database_recommendation(item))
         
         # Add OpenAI colleges if needed
         if len(recommendations) < 3 and openai_colleges:
@@ -465,6 +930,11 @@ Remember: Wait for the user to ask for recommendations before providing them!
             Return only the title, no quotes or extra text.
             """
             
+            cache_key = llm_cache_key("gpt-3.5-turbo", {"temperature": 0.3, "max_tokens": 50}, prompt)
+            title = self.llm_cache.get(cache_key)
+            if title:
+                return title
+            
             response = openai.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": prompt}],
@@ -472,8 +942,12 @@ Remember: Wait for the user to ask for recommendations before providing them!
                 max_tokens=50
             )
             
-            title = response.choices[0].message.content.strip()
-            return title[:30] if len(title) > 30 else title
+            title = (response.choices[0].message.content or '').strip()
+            title = title[:30] if len(title) > 30 else title
+            if not title:
+                return "New Chat"  # not cached, so the next chat asks again
+            self.llm_cache.set(cache_key, title)
+            return title
         except:
             return "New Chat"
     
@@ -491,17 +965,27 @@ Remember: Wait for the user to ask for recommendations before providing them!
             title = self.generate_chat_title(user_input)
             self.db_manager.update_chat_title(session_id, title)
         
-        # Extract preferences from current conversation
-        preferences = self.extract_preferences_with_llm(session_id, user_id, user_input)
+        # Update preferences and detect recommendation intent in one call
+        preferences, wants_recommendations = self.analyze_turn(session_id, user_id, user_input)
         
         # Check if user is asking for recommendations
-        if self.is_asking_for_recommendations(user_input):
+        if wants_recommendations:
             print(f"Recommendation request detected. Preferences: {preferences}")
             
             # Filter colleges from database
-            filtered_colleges = self.data_manager.filter_colleges_by_preferences(preferences)
+            filtered_colleges = self.data_manager.filter_colleges_by_preferences(preferences, query=user_input)
+            
+            # "Colleges like X" is answered from the similarity index. Rows are looked up
+            # in one catalog version, as a reload may renumber them.
+            catalog = self.data_manager.catalog
+            liked_row = self.data_manager.find_liked_college(user_input, catalog)
+            similar_colleges = self.data_manager.similar_rows(liked_row, catalog=catalog) if liked_row is not None else []
+            
+            if similar_colleges:
+                response = f"Here are colleges similar to {catalog.colleges[liked_row].name}:\n\n"
+                final_response = response + self.format_college_recommendations(similar_colleges, [], preferences)
             
-            if not filtered_colleges and preferences.location:
+            elif not filtered_colleges and preferences.location:
                 # No colleges found in database, get from OpenAI
                 response = f"I don't have specific colleges for {preferences.location} in my database. Let me suggest some well-known institutions in that area:\n\n"
                 openai_colleges = self.get_openai_college_recommendations(preferences, preferences.location)
@@ -559,6 +1043,7 @@ Remember: Wait for the user to ask for recommendations before providing them!
         
         return final_response
     
-    def get_session_history(self, session_id: str, user_id: str) -> List[Dict]:
-        """Get complete chat history for a session"""
-        return self.db_manager.get_session_messages(session_id, user_id)
\ No newline at end of file
+    def get_session_history(self, session_id: str, user_id: str, limit: int = 50,
+                            before_id: Optional[int] = None) -> Dict:
+        """Get a page of chat history for a session; pass next_before_id as before_id for older messages"""
+        return self.db_manager.get_messages_page(session_id, user_id, limit, before_id)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+class BM25Index:
+    """Sparse BM25 index over pre-tokenized documents.
+
+    Each token maps to the rows containing it and their BM25 term weights,
+    computed once at build time, so scoring a query is a handful of
+    vectorized additions.
+    """
+
+    def __init__(self, documents: List[Dict[str, int]], k1: float = 1.5, b: float = 0.75):
+        self.size = len(documents)
+        lengths = np.array([sum(doc.values()) for doc in documents], dtype=np.float32)
+        average_length = float(lengths.mean()) if self.size else 0.0
+
+        rows_by_token = {}
+        for row, doc in enumerate(documents):
+            for token, count in doc.items():
+                rows, counts = rows_by_token.setdefault(token, ([], []))
+                rows.append(row)
+                counts.append(count)
+
+        # token -> (row ids, BM25 weight of the token in each row)
+        self.postings = {}
+        for token, (rows, counts) in rows_by_token.items():
+            rows = np.array(rows, dtype=np.int32)
+            counts = np.array(counts, dtype=np.float32)
+            idf = math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            length_norm = k1 * (1 - b + b * lengths[rows] / (average_length or 1.0))
+            weights = idf * counts * (k1 + 1) / (counts + length_norm)
+            self.postings[token] = (rows, weights.astype(np.float32))
+
+    def known_terms(self, tokens: List[str]) -> List[str]:
+        """Sorted distinct query tokens that occur in the index"""
+        return sorted(set(token for token in tokens if token in self.postings))
+
+    def score(self, tokens: List[str]) -> np.ndarray:
+        """BM25 score of every document for the query tokens"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokens):
+            posting = self.postings.get(token)
+            if posting is not None:
+                rows, weights = posting
+                scores[rows] += weights
+        return scores
+
+    def search(self, tokens: List[str], k: int = 10, rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top k (row, score) pairs for the query, optionally restricted to rows"""
+        if k <= 0:
+            return []
+        scores = self.score(tokens)
+        if rows is not None:
+            restricted = np.zeros(self.size, dtype=np.float32)
+            restricted[rows] = scores[rows]
+            scores = restricted
+
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(int(row), float(scores[row])) for row in hits]
+
+
+class SimilarityIndex:
+    """Nearest neighbours between documents, computed when first asked for.
+
+    Features become L2-normalised TF-IDF vectors kept twice as sparse arrays:
+    by document, to read one document's vector, and by feature, to score it
+    against every other document with a handful of vectorized additions.
+    Building is linear in the number of features, and the top n_neighbors of
+    a queried document are cached.
+    """
+
+    def __init__(self, features: List[List[str]], n_neighbors: int = 10, cache_size: int = 4096):
+        self.size = len(features)
+        self.n_neighbors = min(n_neighbors, max(self.size - 1, 0))
+        self.cache_size = cache_size
+        self._neighbors = {}
+
+        ids = {}
+        rows, columns = [], []
+        for row, row_features in enumerate(features):
+            for feature in row_features:
+                rows.append(row)
+                columns.append(ids.setdefault(feature, len(ids)))
+        vocabulary_size = max(len(ids), 1)
+
+        # Repeated features of a document become one entry with a count, sorted by document then feature
+        keys = np.array(rows, dtype=np.int64) * vocabulary_size + np.array(columns, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        rows = (keys // vocabulary_size).astype(np.int32)
+        columns = (keys % vocabulary_size).astype(np.int32)
+
+        document_frequency = np.bincount(columns, minlength=vocabulary_size)
+        weights = counts * (np.log((1 + self.size) / (1 + document_frequency)) + 1)[columns]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=self.size))
+        weights = (weights / np.where(norms > 0, norms, 1)[rows]).astype(np.float32)
+
+        self.row_offsets = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=self.size))))
+        self.row_features = columns
+        self.row_weights = weights
+        order = np.argsort(columns, kind='stable')
+        self.feature_offsets = np.concatenate(([0], np.cumsum(document_frequency)))
+        self.feature_rows = rows[order]
+        self.feature_weights = weights[order]
+
+    def _top_neighbors(self, row: int) -> List[Tuple[int, float]]:
+        """The n_neighbors documents with the highest positive cosine similarity to row"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        start, end = self.row_offsets[row], self.row_offsets[row + 1]
+        for feature, weight in zip(self.row_features[start:end], self.row_weights[start:end]):
+            first, last = self.feature_offsets[feature], self.feature_offsets[feature + 1]
+            scores[self.feature_rows[first:last]] += weight * self.feature_weights[first:last]
+        scores[row] = 0  # never your own neighbour
+
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > self.n_neighbors:
+            hits = hits[np.argpartition(-scores[hits], self.n_neighbors - 1)[:self.n_neighbors]]
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(int(neighbor), float(scores[neighbor])) for neighbor in hits]
+
+    def similar(self, row: int, k: int = 5) -> List[Tuple[int, float]]:
+        """Up to k (row, cosine similarity) neighbours of a document, most similar first"""
+        neighbors = self._neighbors.get(row)
+        if neighbors is None:
+            neighbors = self._top_neighbors(row) if self.n_neighbors else []
+            if len(self._neighbors) >= self.cache_size:
+                self._neighbors.clear()
+            self._neighbors[row] = neighbors
+        return neighbors[:k]
@@ -1,121 +1,961 @@
+import os
+import re
 import sqlite3
 import json
+import zlib
 import hashlib
 import uuid
-from datetime import datetime
-from typing import List, Dict, Optional
+import queue
+import atexit
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
 import bcrypt
 
+try:
+    import zstandard
+except ImportError:  # optional; cold storage falls back to zlib
+    zstandard = None
+
+from cache_utils import TTLCache
+from college_catalog import search_tokens
+
+def _backfill_message_search(conn: sqlite3.Connection):
+    """Index messages stored before the search index existed, hot and archived"""
+    conn.execute('''
+        INSERT INTO messages_fts (rowid, owner, content)
+        SELECT id, replace(user_id, '-', ''), content FROM messages
+    ''')
+    dictionaries = {
+        session_id: (codec, bytes(dictionary))
+        for session_id, codec, dictionary in conn.execute('SELECT session_id, codec, dictionary FROM archive_dictionaries')
+    }
+    conn.executemany(
+        'INSERT INTO messages_fts (rowid, owner, content) VALUES (?, ?, ?)',
+        (
+            (message_id, (user_id or '').replace('-', ''), decompress_archived(*dictionaries[session_id], blob))
+            for message_id, session_id, user_id, blob in conn.execute(
+                'SELECT id, session_id, user_id, content FROM message_archive'
+            ).fetchall()
+        )
+    )
+
+# Schema migrations as (version, description, steps), applied in order by init_database.
+# A step is an SQL statement or a function taking the connection. The applied version is
+# stored in PRAGMA user_version; never edit a released migration, append a new one instead.
+SCHEMA_MIGRATIONS = [
+    (1, 'create tables', [
+        # Create users table
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+        ''',
+        # Create chat_sessions table (renamed from sessions)
+        '''
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            title TEXT DEFAULT 'New Chat',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Update messages table to include user_id
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            user_id TEXT,
+            message_type TEXT,
+            content TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Update user preferences table
+        '''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            preferences TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Create user_sessions table for login session management
+        '''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            session_token TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    ]),
+    (2, 'add indexes for session, message and token lookups', [
+        # get_session_messages / message counts: filter by session, read in timestamp order
+        'CREATE INDEX IF NOT EXISTS idx_messages_session_timestamp ON messages (session_id, timestamp)',
+        # get_user_chat_sessions: active chats of a user, most recently updated first
+        'CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_active_updated ON chat_sessions (user_id, is_active, updated_at)',
+        # per-user token lookups and expiry sweeps; token lookups themselves use the primary key
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_user_active ON user_sessions (user_id, is_active)',
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at)',
+    ]),
+    (3, 'denormalize message counters onto chat_sessions', [
+        'ALTER TABLE chat_sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE chat_sessions ADD COLUMN last_message_at TIMESTAMP',
+        '''
+        UPDATE chat_sessions SET
+            message_count = (SELECT COUNT(*) FROM messages WHERE session_id = chat_sessions.session_id),
+            last_message_at = (SELECT MAX(timestamp) FROM messages WHERE session_id = chat_sessions.session_id)
+        ''',
+    ]),
+    (4, 'add archive tables for deleted chats', [
+        '''
+        CREATE TABLE IF NOT EXISTS archived_chat_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            title TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            message_count INTEGER,
+            last_message_at TIMESTAMP,
+            preferences TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS archived_messages (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT,
+            user_id TEXT,
+            message_type TEXT,
+            content TEXT,
+            timestamp TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_archived_messages_session ON archived_messages (session_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_archived_chat_sessions_user ON archived_chat_sessions (user_id)',
+        # Maintenance finds deleted chats by last activity
+        'CREATE INDEX IF NOT EXISTS idx_chat_sessions_active_updated ON chat_sessions (is_active, updated_at)',
+    ]),
+    (5, 'add compressed cold storage for messages of idle chats', [
+        # Same ids and columns as messages, content compressed with the session's dictionary
+        '''
+        CREATE TABLE IF NOT EXISTS message_archive (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            user_id TEXT,
+            message_type TEXT,
+            timestamp TIMESTAMP,
+            content BLOB
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_message_archive_session_timestamp ON message_archive (session_id, timestamp)',
+        '''
+        CREATE TABLE IF NOT EXISTS archive_dictionaries (
+            session_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            dictionary BLOB NOT NULL
+        )
+        ''',
+    ]),
+    (6, 'add full-text search over chat messages', [
+        # Contentless: only the index is stored, text stays in messages / message_archive. The
+        # owner column holds the user id as one token so searches are scoped inside the index.
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            owner, content, content='', tokenize='porter unicode61'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, owner, content)
+            VALUES (new.id, replace(new.user_id, '-', ''), new.content);
+        END
+        ''',
+        _backfill_message_search,
+    ]),
+]
+
+ARCHIVE_DICTIONARY_SIZE = 32 * 1024  # zlib cannot use more than its 32 KiB window
+
+def build_archive_dictionary(contents: List[str], max_size: int = ARCHIVE_DICTIONARY_SIZE) -> bytes:
+    """Raw-content compression dictionary built from a session's own messages.
+    
+    Recommendation replies are pretty-printed JSON, so lines such as keys and college
+    fields recur across the messages of a chat. The dictionary holds the lines that
+    appear in more than one message, the most valuable last where the compressor
+    reaches them cheapest, and is kept to about a sixteenth of the session's text
+    since it is stored alongside it.
+    """
+    encoded = [content.encode('utf-8') for content in contents if content]
+    size = min(max_size, sum(len(data) for data in encoded) // 16)
+    line_counts = Counter(line for data in encoded for line in set(data.split(b'\n')) if line.strip())
+    repeated = sorted(
+        (line for line, count in line_counts.items() if count > 1),
+        key=lambda line: line_counts[line] * len(line),
+        reverse=True
+    )
+    
+    chosen, used = [], 0
+    for line in repeated:
+        if used + len(line) + 1 <= size:
+            chosen.append(line)
+            used += len(line) + 1
+    return b'\n'.join(reversed(chosen))
+
+def compress_archived(codec: str, dictionary: bytes, content: str) -> bytes:
+    data = content.encode('utf-8')
+    if codec == 'raw':
+        return data
+    if codec == 'zstd':
+        dict_data = zstandard.ZstdCompressionDict(dictionary, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        return zstandard.ZstdCompressor(level=10, dict_data=dict_data).compress(data)
+    compressor = zlib.compressobj(9, zdict=dictionary) if dictionary else zlib.compressobj(9)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress_archived(codec: str, dictionary: bytes, blob: bytes) -> str:
+    if codec == 'raw':
+        return bytes(blob).decode('utf-8')
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('Archived messages were compressed with zstd; install the zstandard package')
+        dict_data = zstandard.ZstdCompressionDict(dictionary, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(blob).decode('utf-8')
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return (decompressor.decompress(blob) + decompressor.flush()).decode('utf-8')
+
+# Words that describe the conversation rather than its subject ("the chat where I asked about ...")
+HISTORY_SEARCH_STOPWORDS = frozenset('about ask asked chat chats conversation discussed said talked told'.split())
+
+# Hot read queries, shared with benchmarks.py so its query-plan check covers exactly what runs here
+VERIFY_TOKEN_SQL = '''
+    SELECT us.user_id, u.username, u.email,
+           (julianday(us.expires_at) - julianday('now')) * 86400
+    FROM user_sessions us
+    JOIN users u ON us.user_id = u.user_id
+    WHERE us.session_token = ? AND us.is_active = TRUE
+    AND us.expires_at > datetime('now')
+'''
+
+USER_CHATS_SQL = '''
+    SELECT session_id, title, created_at, updated_at, message_count, last_message_at
+    FROM chat_sessions
+    WHERE user_id = ? AND is_active = TRUE
+    ORDER BY updated_at DESC
+'''
+
+SESSION_MESSAGES_SQL = '''
+    SELECT m.message_type, m.content, m.timestamp
+    FROM messages m
+    JOIN chat_sessions cs ON m.session_id = cs.session_id
+    WHERE m.session_id = ? AND cs.user_id = ?
+    ORDER BY m.timestamp
+'''
+
+# Newest-first windows of a chat's hot and archived messages; the PAGE variants continue
+# below a (timestamp, id) keyset cursor
+_MESSAGE_WINDOW_SQL = '''
+    SELECT m.id, m.message_type, m.content, m.timestamp
+    FROM {table} m
+    JOIN chat_sessions cs ON m.session_id = cs.session_id
+    WHERE m.session_id = ? AND cs.user_id = ? {cursor}
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT ?
+'''
+_KEYSET_CURSOR = 'AND (m.timestamp, m.id) < (?, ?)'
+RECENT_MESSAGES_SQL = _MESSAGE_WINDOW_SQL.format(table='messages', cursor='')
+MESSAGES_PAGE_SQL = _MESSAGE_WINDOW_SQL.format(table='messages', cursor=_KEYSET_CURSOR)
+RECENT_ARCHIVED_SQL = _MESSAGE_WINDOW_SQL.format(table='message_archive', cursor='')
+ARCHIVED_PAGE_SQL = _MESSAGE_WINDOW_SQL.format(table='message_archive', cursor=_KEYSET_CURSOR)
+
+# Best-ranked full-text hits; ranking inside FTS5 ("rank MATCH") avoids sorting every match.
+# Column weights: the owner column only filters, it does not score.
+SEARCH_HITS_SQL = '''
+    SELECT rowid, rank
+    FROM messages_fts
+    WHERE messages_fts MATCH ? AND rank MATCH 'bm25(0.0, 1.0)'
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+'''
+
+def message_snippet(content: str, terms: List[str], width: int = 160) -> str:
+    """Single-line excerpt of a message around the first search term it contains"""
+    text = ' '.join(content.split())
+    match = re.search(r'\b(?:' + '|'.join(map(re.escape, terms)) + ')', text, re.IGNORECASE) if terms else None
+    start = max(0, match.start() - width // 3) if match else 0
+    excerpt = text[start:start + width]
+    return ('...' if start else '') + excerpt + ('...' if start + width < len(text) else '')
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections shared between threads"""
+    
+    def __init__(self, db_path: str, max_connections: int = 8, busy_timeout_ms: int = 5000,
+                 cached_statements: int = 256):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        # Every connection to an in-memory database is a separate database
+        self.max_connections = 1 if db_path == ':memory:' else max_connections
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        # Only takes effect on a new database; must precede the switch to WAL
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # WAL lets readers proceed while a writer commits; NORMAL sync is durable across app crashes in WAL mode
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_connections:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._create_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.busy_timeout_ms / 1000)
+        except queue.Empty:
+            # queue.Empty has no message; callers report str(e), which would be blank
+            raise sqlite3.OperationalError(
+                f'connection pool exhausted: all {self.max_connections} connections busy '
+                f'for {self.busy_timeout_ms / 1000:g}s'
+            ) from None
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; the transaction is committed on success and rolled back on error"""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+    
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+class PasswordHasher:
+    """Bounded worker pool for bcrypt hashing and verification"""
+    
+    def __init__(self, rounds: int = 12, workers: Optional[int] = None, max_pending: int = 64):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        # bcrypt releases the GIL while hashing, so worker threads run in parallel and a
+        # request thread only blocks on its own result
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.rejected = 0
+    
+    def _submit(self, fn, *args) -> Future:
+        # Shed load instead of letting a login spike build an unbounded backlog
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHasherBusy('Too many login requests in progress, please try again')
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+    def hash_async(self, password: str) -> Future:
+        """Hash a password with the configured cost factor in the background"""
+        return self._submit(
+            lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('utf-8')
+        )
+    
+    def hash(self, password: str) -> str:
+        """Hash a password with the configured cost factor"""
+        return self.hash_async(password).result()
+    
+    def verify(self, password: str, hashed: str) -> bool:
+        """Check a password against a bcrypt hash"""
+        return self._submit(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8')).result()
+    
+    def needs_rehash(self, hashed: str) -> bool:
+        """True if the hash was made with a different cost factor than the configured one"""
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
 class EnhancedDatabaseManager:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, max_connections: int = 8, write_behind: bool = False,
+                 max_batch_size: int = 500, token_cache_size: int = 10000, token_cache_ttl: float = 60,
+                 bcrypt_rounds: int = 12, bcrypt_workers: Optional[int] = None, bcrypt_max_pending: int = 64,
+                 maintenance_interval: float = 0, archive_after_days: float = 7,
+                 compress_after_days: float = 30, write_retries: int = 5):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, max_connections=max_connections)
         self.init_database()
-    
-    def init_database(self):
-        """Initialize the SQLite database with user management tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.password_hasher = PasswordHasher(bcrypt_rounds, bcrypt_workers, bcrypt_max_pending)
         
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE
-            )
-        ''')
+        # Recently verified session tokens. Logout evicts locally; other processes sharing the
+        # database may keep accepting a logged-out token for at most token_cache_ttl seconds.
+        self.token_cache = TTLCache(max_size=token_cache_size, ttl=token_cache_ttl)
         
-        # Create chat_sessions table (renamed from sessions)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_sessions (
-                session_id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                title TEXT DEFAULT 'New Chat',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+        # Write-behind mode: messages and preferences are queued and persisted by a background
+        # writer in batched transactions. Until then they are served from the pending overlay.
+        self.write_behind = write_behind
+        self.max_batch_size = max_batch_size
+        self.write_retries = write_retries
+        self.dropped_writes = 0
+        self._write_queue = queue.Queue()
+        self._pending_messages = {}  # session_id -> [(user_id, message dict)] in insertion order
+        self._pending_preferences = {}  # session_id -> (user_id, preferences json)
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # held while a batch is committed and leaves the overlay
+        self._writer = None
         
-        # Update messages table to include user_id
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                user_id TEXT,
-                message_type TEXT,
-                content TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+        # Background maintenance: purge dead tokens, archive deleted chats, reclaim space
+        self.maintenance_interval = maintenance_interval
+        self.archive_after_days = archive_after_days
+        self.compress_after_days = compress_after_days
+        self._dictionary_cache = TTLCache(max_size=256)  # session_id -> (codec, dictionary)
+        self.maintenance_stats = {
+            'runs': 0,
+            'last_run_at': None,
+            'last_duration_ms': None,
+            'last_error': None,
+            'purged_tokens': 0,
+            'archived_sessions': 0,
+            'archived_messages': 0,
+            'compressed_messages': 0,
+            'compressed_bytes_saved': 0,
+            'vacuumed_pages': 0,
+            'table_rows': {}  # as of the last run; counting on every metrics request would scan
+        }
+        self._maintenance_lock = threading.Lock()
+        self._stop_maintenance = threading.Event()
+        self._maintainer = None
+        if maintenance_interval > 0:
+            self.start_maintenance()
         
-        # Update user preferences table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                session_id TEXT PRIMARY KEY,
-                user_id TEXT,
-                preferences TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+        if write_behind:
+            self._writer = threading.Thread(target=self._write_loop, name='db-write-behind', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+    
+    def close(self):
+        """Drain queued writes and close pooled database connections"""
+        self.stop_maintenance()
+        if self._writer is not None:
+            self._write_queue.put(None)
+            self._writer.join()
+            self._writer = None
+        self.password_hasher.shutdown()
+        self.pool.close()
+    
+    def flush(self):
+        """Block until every queued write has been committed"""
+        if self._writer is not None:
+            self._write_queue.join()
+    
+    def _write_loop(self):
+        while True:
+            batch = [self._write_queue.get()]
+            while batch[-1] is not None and len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            writes = [item for item in batch if item is not None]
+            for attempt in range(self.write_retries + 1):
+                if not writes:
+                    break
+                try:
+                    self._write_batch(writes)
+                    break
+                except Exception as e:
+                    # Keep the batch (and the overlay serving it) and retry; the database may be locked
+                    print(f"Error flushing queued writes (attempt {attempt + 1}): {e}")
+                    if attempt < self.write_retries:
+                        time.sleep(min(0.1 * 2 ** attempt, 5))
+            else:
+                # Still failing: save what can be saved one write at a time and drop the rest,
+                # so flush(), run_maintenance() and close() do not wait forever
+                for write in writes:
+                    try:
+                        self._write_batch([write])
+                    except Exception as e:
+                        print(f"Dropping queued {write[0]} write for session {write[1]}: {e}")
+                        self._discard_pending([write])
+                        self.dropped_writes += 1
+            
+            for _ in batch:
+                self._write_queue.task_done()
+            if batch[-1] is None:
+                return
+    
+    def _write_batch(self, writes: List[tuple]):
+        """Persist queued writes in one transaction, then drop them from the pending overlay"""
+        messages = [write[1:] for write in writes if write[0] == 'message']
+        preferences = {}
+        for write in writes:
+            if write[0] == 'preferences':
+                preferences[write[1]] = write[2]  # only the latest update per session matters
         
-        # Create user_sessions table for login session management
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                session_token TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP NOT NULL,
-                is_active BOOLEAN DEFAULT TRUE,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+        session_updates = {}
+        for session_id, (user_id, message) in messages:
+            count, _ = session_updates.get(session_id, (0, None))
+            session_updates[session_id] = (count + 1, message['timestamp'])
+        
+        with self._flush_lock:
+            with self.pool.connection() as conn:
+                conn.executemany(
+                    'INSERT INTO messages (session_id, user_id, message_type, content, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (session_id, user_id, message['type'], message['content'], message['timestamp'])
+                        for session_id, (user_id, message) in messages
+                    ]
+                )
+                conn.executemany('''
+                    UPDATE chat_sessions SET
+                        updated_at = ?,
+                        message_count = message_count + ?,
+                        last_message_at = ?
+                    WHERE session_id = ?
+                ''', [
+                    (timestamp, count, timestamp, session_id)
+                    for session_id, (count, timestamp) in session_updates.items()
+                ])
+                conn.executemany(
+                    'INSERT OR REPLACE INTO user_preferences (session_id, user_id, preferences) VALUES (?, ?, ?)',
+                    [(session_id, user_id, data) for session_id, (user_id, data) in preferences.items()]
+                )
+            
+            self._discard_pending(writes)
+    
+    def _discard_pending(self, writes: List[tuple]):
+        """Remove written (or dropped) writes from the pending overlay"""
+        with self._pending_lock:
+            for write in writes:
+                if write[0] == 'message':
+                    session_id, entry = write[1:]
+                    pending = self._pending_messages[session_id]
+                    pending.remove(entry)
+                    if not pending:
+                        del self._pending_messages[session_id]
+                elif self._pending_preferences.get(write[1]) is write[2]:
+                    # A newer update queued meanwhile stays in the overlay
+                    del self._pending_preferences[write[1]]
+    
+    def start_maintenance(self):
+        """Run maintenance every maintenance_interval seconds in the background"""
+        if self._maintainer is not None and self._maintainer.is_alive():
+            return
+        self._stop_maintenance.clear()
+        self._maintainer = threading.Thread(target=self._maintenance_loop, name='db-maintenance', daemon=True)
+        self._maintainer.start()
+    
+    def stop_maintenance(self):
+        """Stop the background maintenance thread"""
+        self._stop_maintenance.set()
+        if self._maintainer is not None:
+            self._maintainer.join()
+            self._maintainer = None
+    
+    def _maintenance_loop(self):
+        while not self._stop_maintenance.wait(self.maintenance_interval):
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f"Error running database maintenance: {e}")
+    
+    def run_maintenance(self, batch_size: int = 1000, vacuum_pages: int = 1000) -> Dict:
+        """Purge dead login tokens, archive old deleted chats, compress idle ones and reclaim free pages.
         
-        conn.commit()
-        conn.close()
+        Work is done in small batches so no transaction holds the write lock for long.
+        Returns what this run did; cumulative numbers are kept in maintenance_stats.
+        """
+        with self._maintenance_lock:
+            start = time.perf_counter()
+            run = {'purged_tokens': 0, 'archived_sessions': 0, 'archived_messages': 0,
+                   'compressed_messages': 0, 'compressed_bytes_saved': 0, 'vacuumed_pages': 0}
+            try:
+                self.flush()  # queued messages must not land in a chat after it is archived
+                run['purged_tokens'] = self._purge_tokens(batch_size)
+                run['archived_sessions'], run['archived_messages'] = self._archive_deleted_chats(batch_size)
+                run['compressed_messages'], run['compressed_bytes_saved'] = self._compress_idle_chats()
+                run['vacuumed_pages'] = self._reclaim_space(vacuum_pages)
+                self.maintenance_stats['table_rows'] = self._table_rows()
+                self.maintenance_stats['last_error'] = None
+            except Exception as e:
+                self.maintenance_stats['last_error'] = str(e)
+                raise
+            finally:
+                for key, value in run.items():
+                    self.maintenance_stats[key] += value
+                self.maintenance_stats['runs'] += 1
+                self.maintenance_stats['last_run_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                self.maintenance_stats['last_duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            return run
+    
+    def _purge_tokens(self, batch_size: int) -> int:
+        """Delete expired and logged-out session tokens"""
+        purged = 0
+        for condition in ("expires_at <= datetime('now')", 'is_active = FALSE'):
+            while True:
+                with self.pool.connection() as conn:
+                    deleted = conn.execute(f'''
+                        DELETE FROM user_sessions WHERE rowid IN (
+                            SELECT rowid FROM user_sessions WHERE {condition} LIMIT ?
+                        )
+                    ''', (batch_size,)).rowcount
+                purged += deleted
+                if deleted < batch_size:
+                    break
+        return purged
+    
+    def _archive_deleted_chats(self, batch_size: int):
+        """Move chats deleted more than archive_after_days ago, with their messages, to the archive tables"""
+        archived_sessions = archived_messages = 0
+        cutoff = f'-{float(self.archive_after_days)} days'
+        while True:
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                session_ids = [row[0] for row in conn.execute('''
+                    SELECT session_id FROM chat_sessions
+                    WHERE is_active = FALSE AND updated_at < datetime('now', ?)
+                    LIMIT ?
+                ''', (cutoff, batch_size))]
+                if not session_ids:
+                    break
+                
+                conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (session_id TEXT PRIMARY KEY)')
+                conn.execute('DELETE FROM archive_batch')
+                conn.executemany('INSERT INTO archive_batch VALUES (?)', [(session_id,) for session_id in session_ids])
+                
+                conn.execute('''
+                    INSERT OR REPLACE INTO archived_chat_sessions
+                        (session_id, user_id, title, created_at, updated_at, message_count, last_message_at, preferences)
+                    SELECT cs.session_id, cs.user_id, cs.title, cs.created_at, cs.updated_at,
+                           cs.message_count, cs.last_message_at, up.preferences
+                    FROM chat_sessions cs
+                    LEFT JOIN user_preferences up ON up.session_id = cs.session_id
+                    WHERE cs.session_id IN (SELECT session_id FROM archive_batch)
+                ''')
+                archived_messages += conn.execute('''
+                    INSERT OR REPLACE INTO archived_messages (id, session_id, user_id, message_type, content, timestamp)
+                    SELECT id, session_id, user_id, message_type, content, timestamp FROM messages
+                    WHERE session_id IN (SELECT session_id FROM archive_batch)
+                ''').rowcount
+                
+                # Messages already in cold storage are archived as plain text too
+                compressed_rows = conn.execute('''
+                    SELECT id, session_id, user_id, message_type, content, timestamp FROM message_archive
+                    WHERE session_id IN (SELECT session_id FROM archive_batch)
+                ''').fetchall()
+                archived_messages += len(compressed_rows)
+                decompressed = [
+                    (message_id, session_id, user_id, message_type,
+                     decompress_archived(*self._archive_dictionary(conn, session_id), blob), timestamp)
+                    for message_id, session_id, user_id, message_type, blob, timestamp in compressed_rows
+                ]
+                conn.executemany(
+                    'INSERT OR REPLACE INTO archived_messages (id, session_id, user_id, message_type, content, timestamp) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    decompressed
+                )
+                
+                # Archived chats are no longer searchable. The index is contentless, so FTS5 needs
+                # the values that were indexed to remove a row.
+                conn.execute('''
+                    INSERT INTO messages_fts (messages_fts, rowid, owner, content)
+                    SELECT 'delete', id, replace(user_id, '-', ''), content FROM messages
+                    WHERE session_id IN (SELECT session_id FROM archive_batch)
+                ''')
+                conn.executemany(
+                    "INSERT INTO messages_fts (messages_fts, rowid, owner, content) VALUES ('delete', ?, ?, ?)",
+                    [
+                        (message_id, (user_id or '').replace('-', ''), content)
+                        for message_id, _, user_id, _, content, _ in decompressed
+                    ]
+                )
+                
+                for table in ('messages', 'message_archive', 'archive_dictionaries', 'user_preferences', 'chat_sessions'):
+                    conn.execute(f'DELETE FROM {table} WHERE session_id IN (SELECT session_id FROM archive_batch)')
+                archived_sessions += len(session_ids)
+            
+            for session_id in session_ids:
+                self._dictionary_cache.pop(session_id)
+            
+            if len(session_ids) < batch_size:
+                break
+        return archived_sessions, archived_messages
+    
+    def _compress_idle_chats(self, sessions_per_batch: int = 20):
+        """Move messages of chats idle for compress_after_days into compressed cold storage"""
+        compressed = saved = 0
+        cutoff = f'-{float(self.compress_after_days)} days'
+        while True:
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                session_ids = [row[0] for row in conn.execute('''
+                    SELECT session_id FROM chat_sessions cs
+                    WHERE is_active = TRUE AND updated_at < datetime('now', ?)
+                    AND EXISTS (SELECT 1 FROM messages WHERE session_id = cs.session_id)
+                    LIMIT ?
+                ''', (cutoff, sessions_per_batch))]
+                
+                for session_id in session_ids:
+                    rows = conn.execute(
+                        'SELECT id, user_id, message_type, content, timestamp FROM messages '
+                        'WHERE session_id = ? ORDER BY timestamp, id',
+                        (session_id,)
+                    ).fetchall()
+                    contents = [row[3] or '' for row in rows]
+                    entry = self._archive_dictionary(conn, session_id)
+                    new_dictionary = entry is None
+                    if new_dictionary:
+                        entry = ('zstd' if zstandard is not None else 'zlib', build_archive_dictionary(contents))
+                    blobs = [compress_archived(*entry, content) for content in contents]
+                    session_saved = sum(len(content.encode('utf-8')) for content in contents) - sum(map(len, blobs))
+                    if new_dictionary:
+                        session_saved -= len(entry[1])
+                        if session_saved <= 0:
+                            # Too little text to pay for a dictionary and frame overhead: store it as is
+                            entry = ('raw', b'')
+                            blobs = [compress_archived(*entry, content) for content in contents]
+                            session_saved = 0
+                        # A session keeps its first codec and dictionary forever: existing blobs can only be read with them
+                        conn.execute(
+                            'INSERT INTO archive_dictionaries (session_id, codec, dictionary) VALUES (?, ?, ?)',
+                            (session_id, *entry)
+                        )
+                    saved += session_saved
+                    archived = [
+                        (message_id, session_id, user_id, message_type, timestamp, blob)
+                        for (message_id, user_id, message_type, _, timestamp), blob in zip(rows, blobs)
+                    ]
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO message_archive (id, session_id, user_id, message_type, timestamp, content) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        archived
+                    )
+                    conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+                    compressed += len(rows)
+            
+            if len(session_ids) < sessions_per_batch:
+                break
+        return compressed, saved
+    
+    def _archive_dictionary(self, conn: sqlite3.Connection, session_id: str):
+        """(codec, dictionary) of a session's archive, or None before its first compression"""
+        cached = self._dictionary_cache.get(session_id)
+        if cached is not None:
+            return cached
+        row = conn.execute(
+            'SELECT codec, dictionary FROM archive_dictionaries WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = (row[0], bytes(row[1]))
+        self._dictionary_cache.set(session_id, entry)
+        return entry
+    
+    def _read_archived_messages(self, conn: sqlite3.Connection, session_id: str, user_id: str,
+                                limit: int = -1, before: Optional[tuple] = None) -> List[tuple]:
+        """Newest-first (id, type, content, timestamp) rows from cold storage, decompressing only those returned"""
+        rows = conn.execute(
+            ARCHIVED_PAGE_SQL if before is not None else RECENT_ARCHIVED_SQL,
+            (session_id, user_id, *(before or ()), limit)
+        ).fetchall()
+        if not rows:
+            return []
+        codec, dictionary = self._archive_dictionary(conn, session_id)
+        return [
+            (message_id, message_type, decompress_archived(codec, dictionary, blob), timestamp)
+            for message_id, message_type, blob, timestamp in rows
+        ]
+    
+    def _message_position(self, conn: sqlite3.Connection, message_id: int) -> Optional[tuple]:
+        """(timestamp, id) of a stored message, hot or archived, for keyset cursors"""
+        for table in ('messages', 'message_archive'):
+            row = conn.execute(f'SELECT timestamp, id FROM {table} WHERE id = ?', (message_id,)).fetchone()
+            if row is not None:
+                return tuple(row)
+        return None
+    
+    def _table_rows(self) -> Dict:
+        with self.pool.connection() as conn:
+            return {
+                table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('user_sessions', 'chat_sessions', 'messages', 'message_archive', 'archived_messages')
+            }
+    
+    def _reclaim_space(self, vacuum_pages: int) -> int:
+        """Return free pages to the OS, refresh planner statistics and checkpoint the WAL"""
+        with self.pool.connection() as conn:
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            # Databases created before auto_vacuum was enabled need a one-off VACUUM to opt in
+            incremental = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+            if incremental and free_pages:
+                # execute() would step the pragma once, freeing a single page; a script runs it to completion
+                conn.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)});')
+            reclaimed = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            # Merge a bounded amount of the search index's small segments so queries touch fewer b-trees
+            conn.execute("INSERT INTO messages_fts (messages_fts, rank) VALUES ('merge', 500)")
+            conn.commit()  # the checkpoint below cannot run inside a write transaction
+            conn.execute('PRAGMA optimize')  # runs ANALYZE on tables whose statistics are stale
+            conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+        return reclaimed
+    
+    def get_metrics(self) -> Dict:
+        """Operational counters for the database layer"""
+        with self.pool.connection() as conn:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        
+        return {
+            'maintenance': dict(self.maintenance_stats),
+            'free_bytes': page_size * free_pages,
+            'token_cache': self.token_cache.stats(),
+            'pending_writes': self._write_queue.qsize(),
+            'dropped_writes': self.dropped_writes,
+            'password_hashes_rejected': self.password_hasher.rejected
+        }
+    
+    def _read_with_pending(self, session_id: str, user_id: str, read):
+        """Run read() together with a consistent snapshot of the session's pending messages"""
+        if not self._pending_messages.get(session_id):
+            return read(), []
+        # Holding the flush lock keeps a batch from moving between the overlay and the table mid-read
+        with self._flush_lock:
+            result = read()
+            with self._pending_lock:
+                pending = [
+                    dict(message) for owner, message in self._pending_messages.get(session_id, ())
+                    if owner == user_id
+                ]
+        return result, pending
+    
+    def init_database(self):
+        """Initialize the SQLite database, applying any pending schema migrations"""
+        with self.pool.connection() as conn:
+            # BEGIN IMMEDIATE serializes concurrent app processes migrating the same file
+            conn.execute('BEGIN IMMEDIATE')
+            current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+            
+            for version, description, steps in SCHEMA_MIGRATIONS:
+                if version <= current_version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f'PRAGMA user_version = {version}')
+                print(f"Applied schema migration {version}: {description}")
     
     def hash_password(self, password: str) -> str:
         """Hash password using bcrypt"""
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        return self.password_hasher.hash(password)
     
     def verify_password(self, password: str, hashed: str) -> bool:
         """Verify password against hash"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        return self.password_hasher.verify(password, hashed)
+    
+    def _rehash_password(self, user_id: str, password: str, old_hash: str):
+        """Upgrade a hash made with an outdated cost factor, without delaying the login"""
+        def store(future):
+            try:
+                with self.pool.connection() as conn:
+                    # Only replace the hash that was verified, never a password changed meanwhile
+                    conn.execute(
+                        'UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP '
+                        'WHERE user_id = ? AND password_hash = ?',
+                        (future.result(), user_id, old_hash)
+                    )
+            except Exception as e:
+                print(f"Error rehashing password: {e}")
+        
+        try:
+            self.password_hasher.hash_async(password).add_done_callback(store)
+        except PasswordHasherBusy:
+            pass  # retried on the next login
     
     def create_user(self, username: str, email: str, password: str) -> Dict:
         """Create a new user account"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if username or email already exists
-            cursor.execute(
-                'SELECT user_id FROM users WHERE username = ? OR email = ?',
-                (username, email)
-            )
-            if cursor.fetchone():
+            with self.pool.connection() as conn:
+                # Check if username or email already exists
+                existing = conn.execute(
+                    'SELECT user_id FROM users WHERE username = ? OR email = ?',
+                    (username, email)
+                ).fetchone()
+            if existing:
                 return {'success': False, 'error': 'Username or email already exists'}
             
-            # Create new user
+            # Create new user; bcrypt runs without holding a pooled connection
             user_id = str(uuid.uuid4())
             password_hash = self.hash_password(password)
             
-            cursor.execute(
-                'INSERT INTO users (user_id, username, email, password_hash) VALUES (?, ?, ?, ?)',
-                (user_id, username, email, password_hash)
-            )
-            
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                conn.execute(
+                    'INSERT INTO users (user_id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+                    (user_id, username, email, password_hash)
+                )
             
             return {
                 'success': True,
@@ -129,29 +969,28 @@ class EnhancedDatabaseManager:
     def authenticate_user(self, username: str, password: str) -> Dict:
         """Authenticate user login"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT user_id, username, email, password_hash FROM users WHERE username = ? AND is_active = TRUE',
-                (username,)
-            )
-            user = cursor.fetchone()
+            with self.pool.connection() as conn:
+                user = conn.execute(
+                    'SELECT user_id, username, email, password_hash FROM users WHERE username = ? AND is_active = TRUE',
+                    (username,)
+                ).fetchone()
             
+            # bcrypt runs without holding a pooled connection
             if not user or not self.verify_password(password, user[3]):
                 return {'success': False, 'error': 'Invalid username or password'}
             
+            if self.password_hasher.needs_rehash(user[3]):
+                self._rehash_password(user[0], password, user[3])
+            
             # Create session token
             session_token = str(uuid.uuid4())
             expires_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # You might want to add actual expiration logic
             
-            cursor.execute(
-                'INSERT INTO user_sessions (session_token, user_id, expires_at) VALUES (?, ?, datetime("now", "+7 days"))',
-                (session_token, user[0])
-            )
-            
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                conn.execute(
+                    'INSERT INTO user_sessions (session_token, user_id, expires_at) VALUES (?, ?, datetime("now", "+7 days"))',
+                    (session_token, user[0])
+                )
             
             return {
                 'success': True,
@@ -165,28 +1004,29 @@ class EnhancedDatabaseManager:
     
     def verify_session_token(self, session_token: str) -> Dict:
         """Verify if session token is valid"""
+        cached = self.token_cache.get(session_token)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT us.user_id, u.username, u.email 
-                FROM user_sessions us 
-                JOIN users u ON us.user_id = u.user_id 
-                WHERE us.session_token = ? AND us.is_active = TRUE 
-                AND us.expires_at > datetime('now')
-            ''', (session_token,))
-            
-            user = cursor.fetchone()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(VERIFY_TOKEN_SQL, (session_token,))
+                
+                user = cursor.fetchone()
             
             if user:
-                return {
+                user_data = {
                     'success': True,
                     'user_id': user[0],
                     'username': user[1],
                     'email': user[2]
                 }
+                # Never cache a token past its own expiry
+                ttl = min(self.token_cache.ttl, user[3]) if self.token_cache.ttl else user[3]
+                self.token_cache.set(session_token, user_data, ttl=ttl)
+                return dict(user_data)
             else:
                 return {'success': False, 'error': 'Invalid or expired session'}
         except Exception as e:
@@ -194,15 +1034,13 @@ class EnhancedDatabaseManager:
     
     def logout_user(self, session_token: str) -> bool:
         """Logout user by deactivating session token"""
+        self.token_cache.pop(session_token)
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                'UPDATE user_sessions SET is_active = FALSE WHERE session_token = ?',
-                (session_token,)
-            )
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                conn.execute(
+                    'UPDATE user_sessions SET is_active = FALSE WHERE session_token = ?',
+                    (session_token,)
+                )
             return True
         except:
             return False
@@ -210,96 +1048,106 @@ class EnhancedDatabaseManager:
     def create_chat_session(self, user_id: str, title: str = 'New Chat') -> str:
         """Create a new chat session for a user"""
         session_id = str(uuid.uuid4())
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO chat_sessions (session_id, user_id, title) VALUES (?, ?, ?)',
-            (session_id, user_id, title)
-        )
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT INTO chat_sessions (session_id, user_id, title) VALUES (?, ?, ?)',
+                (session_id, user_id, title)
+            )
         return session_id
     
     def get_user_chat_sessions(self, user_id: str) -> List[Dict]:
         """Get all chat sessions for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT session_id, title, created_at, updated_at,
-                   (SELECT COUNT(*) FROM messages WHERE session_id = cs.session_id) as message_count
-            FROM chat_sessions cs 
-            WHERE user_id = ? AND is_active = TRUE 
-            ORDER BY updated_at DESC
-        ''', (user_id,))
+        def read():
+            with self.pool.connection() as conn:
+                return conn.execute(USER_CHATS_SQL, (user_id,)).fetchall()
         
-        sessions = cursor.fetchall()
-        conn.close()
+        if self._pending_messages:
+            with self._flush_lock:
+                sessions = read()
+                with self._pending_lock:
+                    pending = {session_id: list(entries) for session_id, entries in self._pending_messages.items()}
+        else:
+            sessions, pending = read(), {}
         
-        return [
+        chats = [
             {
                 'session_id': session[0],
                 'title': session[1],
                 'created_at': session[2],
                 'updated_at': session[3],
-                'message_count': session[4]
+                'message_count': session[4],
+                'last_message_at': session[5]
             }
             for session in sessions
         ]
+        for chat in chats:
+            queued = pending.get(chat['session_id'])
+            if queued:
+                chat['message_count'] += len(queued)
+                chat['last_message_at'] = chat['updated_at'] = queued[-1][1]['timestamp']
+        if pending:
+            chats.sort(key=lambda chat: chat['updated_at'], reverse=True)
+        return chats
     
     def update_chat_title(self, session_id: str, title: str):
         """Update chat session title"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE chat_sessions SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE session_id = ?',
-            (title, session_id)
-        )
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            conn.execute(
+                'UPDATE chat_sessions SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE session_id = ?',
+                (title, session_id)
+            )
     
     def delete_chat_session(self, session_id: str, user_id: str) -> bool:
         """Delete (deactivate) a chat session"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                'UPDATE chat_sessions SET is_active = FALSE WHERE session_id = ? AND user_id = ?',
-                (session_id, user_id)
-            )
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                conn.execute(
+                    'UPDATE chat_sessions SET is_active = FALSE, updated_at = CURRENT_TIMESTAMP WHERE session_id = ? AND user_id = ?',
+                    (session_id, user_id)
+                )
             return True
         except:
             return False
     
     def save_message(self, session_id: str, user_id: str, message_type: str, content: str):
         """Save a message to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO messages (session_id, user_id, message_type, content) VALUES (?, ?, ?, ?)',
-            (session_id, user_id, message_type, content)
-        )
-        cursor.execute(
-            'UPDATE chat_sessions SET updated_at = CURRENT_TIMESTAMP WHERE session_id = ?',
-            (session_id,)
-        )
-        conn.commit()
-        conn.close()
+        if self.write_behind:
+            # Same format as SQLite's CURRENT_TIMESTAMP, taken now rather than at flush time
+            timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            entry = (user_id, {'id': None, 'type': message_type, 'content': content, 'timestamp': timestamp})
+            with self._pending_lock:
+                self._pending_messages.setdefault(session_id, []).append(entry)
+            self._write_queue.put(('message', session_id, entry))
+            return
+        
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT INTO messages (session_id, user_id, message_type, content) VALUES (?, ?, ?, ?)',
+                (session_id, user_id, message_type, content)
+            )
+            # Counters live on the session row so the chat list never has to count messages
+            conn.execute('''
+                UPDATE chat_sessions SET
+                    updated_at = CURRENT_TIMESTAMP,
+                    message_count = message_count + 1,
+                    last_message_at = CURRENT_TIMESTAMP
+                WHERE session_id = ?
+            ''', (session_id,))
     
     def get_session_messages(self, session_id: str, user_id: str) -> List[Dict]:
-        """Retrieve all messages for a session (with user verification)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT m.message_type, m.content, m.timestamp 
-            FROM messages m
-            JOIN chat_sessions cs ON m.session_id = cs.session_id
-            WHERE m.session_id = ? AND cs.user_id = ? 
-            ORDER BY m.timestamp
-        ''', (session_id, user_id))
-        messages = cursor.fetchall()
-        conn.close()
+        """Retrieve all messages for a session (with user verification).
+        
+        Decompresses the whole cold archive; use get_messages_page to display a chat.
+        """
+        def read():
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN')  # one snapshot across cold and hot storage
+                archived = self._read_archived_messages(conn, session_id, user_id)
+                return [row[1:] for row in reversed(archived)] + conn.execute(
+                    SESSION_MESSAGES_SQL, (session_id, user_id)
+                ).fetchall()
+        
+        messages, pending = self._read_with_pending(session_id, user_id, read)
         
         return [
             {
@@ -308,29 +1156,177 @@ class EnhancedDatabaseManager:
                 'timestamp': msg[2]
             }
             for msg in messages
+        ] + [
+            {
+                'type': msg['type'],
+                'content': msg['content'],
+                'timestamp': msg['timestamp']
+            }
+            for msg in pending
         ]
     
+    def get_recent_messages(self, session_id: str, user_id: str, limit: int = 10,
+                            before_id: Optional[int] = None) -> List[Dict]:
+        """Retrieve the last `limit` messages of a session, optionally older than message before_id"""
+        # Walks the (session_id, timestamp) index backwards from the newest (or the cursor) message,
+        # so the cost depends on the window size rather than the length of the conversation
+        def read():
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN')  # one snapshot across cold and hot storage
+                before = None
+                if before_id is not None:
+                    before = self._message_position(conn, before_id)
+                    if before is None:
+                        return []
+                
+                messages = conn.execute(
+                    MESSAGES_PAGE_SQL if before is not None else RECENT_MESSAGES_SQL,
+                    (session_id, user_id, *(before or ()), limit)
+                ).fetchall()
+                
+                # Archived messages are older than every hot one; read them only if the window reaches back that far
+                if len(messages) < limit:
+                    oldest = (messages[-1][3], messages[-1][0]) if messages else before
+                    messages += self._read_archived_messages(
+                        conn, session_id, user_id, limit - len(messages), oldest
+                    )
+                return messages
+        
+        if before_id is None:
+            messages, pending = self._read_with_pending(session_id, user_id, read)
+        else:
+            # Pending messages are newer than any stored message, so never before a cursor
+            messages, pending = read(), []
+        
+        return ([
+            {
+                'id': msg[0],
+                'type': msg[1],
+                'content': msg[2],
+                'timestamp': msg[3]
+            }
+            for msg in reversed(messages)
+        ] + pending)[-limit:]
+    
+    def get_messages_page(self, session_id: str, user_id: str, limit: int = 50,
+                          before_id: Optional[int] = None) -> Dict:
+        """Keyset-paginated history: a page of messages (oldest first) and the cursor for the page before it"""
+        if self._pending_messages.get(session_id):
+            self.flush()  # cursors are message ids, which queued messages do not have yet
+        messages = self.get_recent_messages(session_id, user_id, limit + 1, before_id)
+        has_more = len(messages) > limit
+        messages = messages[-limit:] if has_more else messages
+        return {
+            'messages': messages,
+            'next_before_id': messages[0]['id'] if has_more else None
+        }
+    
+    def search_chat_history(self, user_id: str, query: str, limit: int = 10) -> List[Dict]:
+        """Rank the user's chats by full-text relevance of their messages to the query"""
+        terms = list(dict.fromkeys(
+            term for term in search_tokens(query) if term not in HISTORY_SEARCH_STOPWORDS
+        ))
+        if not terms:
+            return []
+        
+        # Tokens are alphanumeric, so quoting them is enough to keep FTS5 syntax out of the query
+        owner = user_id.replace('-', '').replace('"', '""')
+        any_term = ' OR '.join(f'"{term}"' for term in terms)
+        expression = f'owner : "{owner}" AND content : ({any_term})'
+        
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')  # one snapshot across the index and both message tables
+            # Hits in chats that are deleted or belong to someone else are skipped, so keep
+            # paging through the index until enough chats are found
+            page_size = limit * 20
+            results = {}
+            offset = 0
+            while len(results) < limit:
+                hits = conn.execute(SEARCH_HITS_SQL, (expression, page_size, offset)).fetchall()
+                if not hits:
+                    break
+                
+                ids = [hit[0] for hit in hits]
+                placeholders = ','.join('?' * len(ids))
+                located = {}
+                for table in ('messages', 'message_archive'):
+                    for row in conn.execute(f'''
+                        SELECT m.id, m.session_id, m.message_type, m.content, m.timestamp, cs.title, cs.updated_at
+                        FROM {table} m
+                        JOIN chat_sessions cs ON m.session_id = cs.session_id
+                        WHERE m.id IN ({placeholders}) AND cs.user_id = ? AND cs.is_active = TRUE
+                    ''', (*ids, user_id)):
+                        located[row[0]] = (table, row)
+                
+                # Best-scoring message per chat; hits are already in score order
+                for message_id, score in hits:
+                    if message_id not in located or located[message_id][1][1] in results:
+                        continue
+                    table, (_, session_id, message_type, content, timestamp, title, updated_at) = located[message_id]
+                    if table == 'message_archive':
+                        content = decompress_archived(*self._archive_dictionary(conn, session_id), content)
+                    results[session_id] = {
+                        'session_id': session_id,
+                        'title': title,
+                        'updated_at': updated_at,
+                        'score': -score,
+                        'message': {
+                            'id': message_id,
+                            'type': message_type,
+                            'timestamp': timestamp,
+                            'snippet': message_snippet(content or '', terms)
+                        }
+                    }
+                    if len(results) == limit:
+                        break
+                
+                if len(hits) < page_size:
+                    break
+                offset += page_size
+        
+        return list(results.values())
+    
+    def get_logged_turns(self, limit: int = 5000) -> List[Tuple[str, str]]:
+        """The most recent (user message, assistant reply) pairs across all chats"""
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT content, reply FROM (
+                    SELECT message_type, content,
+                           LEAD(message_type) OVER turn AS reply_type,
+                           LEAD(content) OVER turn AS reply
+                    FROM (SELECT * FROM messages ORDER BY id DESC LIMIT ?)
+                    WINDOW turn AS (PARTITION BY session_id ORDER BY timestamp, id)
+                )
+                WHERE message_type = 'human' AND reply_type = 'ai'
+            ''', (limit * 2,)).fetchall()
+        return [(row[0], row[1]) for row in rows]
+    
     def save_preferences(self, session_id: str, user_id: str, preferences: dict):
         """Save user preferences for a specific session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT OR REPLACE INTO user_preferences (session_id, user_id, preferences) VALUES (?, ?, ?)',
-            (session_id, user_id, json.dumps(preferences))
-        )
-        conn.commit()
-        conn.close()
+        if self.write_behind:
+            entry = (user_id, json.dumps(preferences))
+            with self._pending_lock:
+                self._pending_preferences[session_id] = entry
+            self._write_queue.put(('preferences', session_id, entry))
+            return
+        
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO user_preferences (session_id, user_id, preferences) VALUES (?, ?, ?)',
+                (session_id, user_id, json.dumps(preferences))
+            )
     
     def get_preferences(self, session_id: str, user_id: str) -> dict:
         """Get user preferences for a specific session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT preferences FROM user_preferences WHERE session_id = ? AND user_id = ?',
-            (session_id, user_id)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        pending = self._pending_preferences.get(session_id)
+        if pending is not None and pending[0] == user_id:
+            return json.loads(pending[1])
+        
+        with self.pool.connection() as conn:
+            result = conn.execute(
+                'SELECT preferences FROM user_preferences WHERE session_id = ? AND user_id = ?',
+                (session_id, user_id)
+            ).fetchone()
         
         if result:
             return json.loads(result[0])
@@ -338,12 +1334,9 @@ class EnhancedDatabaseManager:
     
     def verify_session_ownership(self, session_id: str, user_id: str) -> bool:
         """Verify if a session belongs to a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT session_id FROM chat_sessions WHERE session_id = ? AND user_id = ? AND is_active = TRUE',
-            (session_id, user_id)
-        )
-        result = cursor.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            result = conn.execute(
+                'SELECT session_id FROM chat_sessions WHERE session_id = ? AND user_id = ? AND is_active = TRUE',
+                (session_id, user_id)
+            ).fetchone()
         return result is not None
\ No newline at end of file
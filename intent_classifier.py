@@ -0,0 +1,106 @@
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Phrases that signal a recommendation request, with their prior weights (log-odds)
+RECOMMENDATION_CUES = {
+    'recommend': 2.5, 'suggest': 2.5, 'suggestions': 2.5, 'colleges': 1.5, 'universities': 1.5,
+    'which college': 3.0, 'best college': 3.0, 'best colleges': 3.0, 'good college': 2.5,
+    'good colleges': 2.5, 'top colleges': 3.0, 'college for': 2.0, 'colleges for': 2.0,
+    'options for': 2.0, 'where should i': 2.5, 'help me find': 2.5, 'looking for college': 3.0,
+    'any college': 2.0, 'colleges in': 2.5, 'suggest college': 3.0, 'show me college': 3.0,
+    'show me': 1.0, 'list of': 1.0, 'similar to': 1.5, 'colleges like': 3.0,
+}
+
+# Phrases typical of small talk and general questions
+CONVERSATION_CUES = {
+    'hi': -2.5, 'hello': -2.5, 'hey': -2.0, 'thanks': -3.0, 'thank you': -3.0, 'bye': -3.0,
+    'ok': -1.5, 'okay': -1.5, 'my name': -2.0, 'what is': -1.5, 'what are': -1.0, 'how do': -1.5,
+    'how does': -1.5, 'how to': -1.5, 'explain': -1.5, 'difference between': -2.0, 'eligibility': -1.0,
+    'i am': -0.5, "i'm": -0.5, 'interested in': -0.5,
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def ngrams(text: str, max_n: int = 3) -> List[str]:
+    """Distinct word n-grams (n <= max_n) of the lowercased text"""
+    words = TOKEN_PATTERN.findall(text.lower())
+    return list(dict.fromkeys(
+        ' '.join(words[i:i + n]) for n in range(1, max_n + 1) for i in range(len(words) - n + 1)
+    ))
+
+
+class IntentClassifier:
+    """Weighted n-gram model telling recommendation requests from conversation.
+
+    Starts from the hand-written cue weights and is refined by logistic
+    regression on logged turns, regularised towards those priors so a small
+    or skewed log cannot wipe them out. Messages scored with at least
+    `threshold` confidence are decided locally; the rest are left to the LLM.
+    """
+
+    def __init__(self, threshold: float = 0.85, bias: float = -1.0):
+        self.threshold = threshold
+        self.priors = {**RECOMMENDATION_CUES, **CONVERSATION_CUES}
+        self.weights = dict(self.priors)
+        self.bias = bias
+        self.trained_on = 0
+        self._lock = threading.Lock()
+        self.fast_path = 0
+        self.escalated = 0
+
+    def fit(self, texts: List[str], labels: List[bool], epochs: int = 5, learning_rate: float = 0.1,
+            regularization: float = 0.01, min_samples: int = 50) -> bool:
+        """Refine the weights on labelled messages; False if there are too few of them (or only one class)"""
+        if len(texts) < min_samples or len(set(labels)) < 2:
+            return False
+
+        weights = dict(self.priors)
+        bias = self.bias
+        samples = [(ngrams(text), 1.0 if label else 0.0) for text, label in zip(texts, labels)]
+        for _ in range(epochs):
+            for features, label in samples:
+                score = bias + sum(weights.get(feature, 0.0) for feature in features)
+                error = label - 1 / (1 + math.exp(-max(min(score, 30.0), -30.0)))
+                bias += learning_rate * error
+                for feature in features:
+                    weight = weights.get(feature, 0.0)
+                    pull = regularization * (weight - self.priors.get(feature, 0.0))
+                    weights[feature] = weight + learning_rate * (error - pull)
+
+        # Features that never moved away from zero only slow down scoring
+        self.weights = {feature: weight for feature, weight in weights.items() if abs(weight) > 1e-3}
+        self.bias = bias
+        self.trained_on = len(samples)
+        return True
+
+    def probability(self, text: str) -> float:
+        """Probability that the message asks for recommendations"""
+        score = self.bias + sum(self.weights.get(feature, 0.0) for feature in ngrams(text))
+        return 1 / (1 + math.exp(-max(min(score, 30.0), -30.0)))
+
+    def classify(self, text: str) -> Tuple[Optional[bool], float]:
+        """(is a recommendation request, confidence); the decision is None when the message is ambiguous"""
+        probability = self.probability(text)
+        confidence = max(probability, 1 - probability)
+        decided = confidence >= self.threshold
+        with self._lock:
+            if decided:
+                self.fast_path += 1
+            else:
+                self.escalated += 1
+        return (probability >= 0.5 if decided else None), confidence
+
+    def stats(self) -> Dict:
+        """Fast-path counters and training size"""
+        with self._lock:
+            total = self.fast_path + self.escalated
+            return {
+                'fast_path': self.fast_path,
+                'escalated': self.escalated,
+                'fast_path_hit_rate': self.fast_path / total if total else 0.0,
+                'threshold': self.threshold,
+                'trained_on': self.trained_on
+            }
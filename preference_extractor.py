@@ -0,0 +1,341 @@
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from college_catalog import (
+    COURSE_PATTERNS, LEVEL_ALIASES, SEARCH_STOPWORDS, CollegeCatalog, tokenize
+)
+
+# Fields of UserPreferences, in declaration order
+PREFERENCE_FIELDS = ('location', 'state', 'course_type', 'college_type', 'level', 'budget_range', 'specific_course')
+
+# Indian states and union territories with their other common spellings
+STATES = {
+    'Andhra Pradesh': (), 'Arunachal Pradesh': (), 'Assam': (), 'Bihar': (), 'Chhattisgarh': ('chattisgarh',),
+    'Goa': (), 'Gujarat': (), 'Haryana': (), 'Himachal Pradesh': (), 'Jharkhand': (), 'Karnataka': (),
+    'Kerala': (), 'Madhya Pradesh': (), 'Maharashtra': (), 'Manipur': (), 'Meghalaya': (), 'Mizoram': (),
+    'Nagaland': (), 'Odisha': ('orissa',), 'Punjab': (), 'Rajasthan': (), 'Sikkim': (), 'Tamil Nadu': (),
+    'Telangana': (), 'Tripura': (), 'Uttar Pradesh': (), 'Uttarakhand': ('uttaranchal',), 'West Bengal': (),
+    'Delhi': ('ncr', 'delhi ncr'), 'Jammu and Kashmir': ('jammu kashmir', 'j k'), 'Ladakh': (),
+    'Chandigarh': (), 'Puducherry': ('pondicherry',),
+}
+
+# Upper-case abbreviations; matched case-sensitively since most are also English words
+STATE_ABBREVIATIONS = {
+    'MP': 'Madhya Pradesh', 'UP': 'Uttar Pradesh', 'AP': 'Andhra Pradesh', 'HP': 'Himachal Pradesh',
+    'TN': 'Tamil Nadu', 'WB': 'West Bengal', 'J&K': 'Jammu and Kashmir', 'JK': 'Jammu and Kashmir',
+}
+STATE_ABBREVIATION_PATTERN = re.compile(r'(?<![A-Za-z&])(J&K|MP|UP|AP|HP|TN|WB|JK)(?![A-Za-z&])')
+
+# Old and alternative city names -> the name used in the catalog
+CITY_ALIASES = {
+    'bangalore': 'bengaluru', 'bombay': 'mumbai', 'madras': 'chennai', 'calcutta': 'kolkata',
+    'gurgaon': 'gurugram', 'mysore': 'mysuru', 'mangalore': 'mangaluru', 'allahabad': 'prayagraj',
+    'trivandrum': 'thiruvananthapuram', 'cochin': 'kochi', 'vizag': 'visakhapatnam', 'baroda': 'vadodara',
+    'benares': 'varanasi', 'banaras': 'varanasi', 'poona': 'pune',
+}
+
+# Location column pieces that are not places users search by
+LOCATION_NOISE_WORDS = frozenset(
+    'campus campuses road nagar layout enclave hills online odl offices office centers centres locations '
+    'others etc main pin india nationwide regional distance programs available has many multiple plus city'.split()
+)
+LOCATION_SPLIT = re.compile(r'[,;()/&|\n–-]|\band\b|\betc\b')
+LOCATION_PREFIX = re.compile(r'^(?:.*:|near|e\.?g\.?|\+)\s*', re.IGNORECASE)
+
+# Course codes that are also English words ("me", "ma", "bed"), recognized only when written in capitals
+CASE_SENSITIVE_COURSES = frozenset(('BA', 'MA', 'BE', 'ME', 'MS', 'MD', 'BED'))
+
+COURSE_DISPLAY_NAMES = {
+    'BTECH': 'BTech', 'MTECH': 'MTech', 'BARCH': 'BArch', 'BDES': 'BDes', 'MDES': 'MDes', 'BPHARM': 'BPharm',
+    'MPHARM': 'MPharm', 'BSC': 'BSc', 'MSC': 'MSc', 'BCOM': 'BCom', 'MCOM': 'MCom', 'BED': 'BEd',
+    'MPHIL': 'MPhil', 'PHD': 'PhD', 'BALLB': 'BA LLB', 'BSTAT': 'BStat', 'MSTAT': 'MStat',
+}
+
+# Course type of each course code
+COURSE_FAMILIES = {
+    'Engineering': ('BTECH', 'MTECH', 'BE', 'ME'), 'Medical': ('MBBS', 'BDS', 'MD', 'MS', 'BPT'),
+    'Management': ('MBA', 'BBA', 'PGDM', 'PGP', 'FPM'), 'Commerce': ('BCOM', 'MCOM'), 'Arts': ('BA', 'MA'),
+    'Science': ('BSC', 'MSC', 'BSTAT', 'MSTAT'), 'Law': ('LLB', 'LLM', 'BALLB'),
+    'Pharmacy': ('BPHARM', 'MPHARM'), 'Architecture': ('BARCH',), 'Design': ('BDES', 'MDES'),
+    'Journalism': ('BJMC', 'MJMC'), 'Education': ('BED',),
+}
+
+# Words users say for a course type
+COURSE_TYPE_WORDS = {
+    'engineering': 'Engineering', 'engineer': 'Engineering', 'medical': 'Medical', 'medicine': 'Medical',
+    'management': 'Management', 'business': 'Management', 'commerce': 'Commerce', 'arts': 'Arts',
+    'humanities': 'Arts', 'science': 'Science', 'sciences': 'Science', 'law': 'Law', 'pharmacy': 'Pharmacy',
+    'architecture': 'Architecture', 'design': 'Design', 'nursing': 'Nursing', 'agriculture': 'Agriculture',
+    'journalism': 'Journalism', 'education': 'Education',
+}
+
+COLLEGE_TYPE_WORDS = {
+    'government': 'Government', 'govt': 'Government', 'sarkari': 'Government',
+    'private': 'Private', 'pvt': 'Private', 'deemed': 'Deemed',
+}
+
+LEVEL_NAMES = {'UG': 'UG', 'PG': 'PG', 'DOCTORAL': 'PhD', 'DIPLOMA': 'Diploma', 'CERTIFICATE': 'Certificate'}
+
+BUDGET_WORDS = ('low', 'cheap', 'affordable', 'medium', 'moderate', 'mid')
+BUDGET_CUE = re.compile(r'\b(?:budget|fees?|cost|costs|afford|expensive|cheap|affordable|lakhs?|lacs?|rupees|rs|inr)\b|₹')
+# An amount only counts as a budget with a unit or currency, so "12th" or "10+2" are not read as fees
+BUDGET_AMOUNT = re.compile(
+    r'(?:(?:₹|\brs\.?|\binr)\s*\d[\d,]*(?:\.\d+)?\s*(?:k|l|lakhs?|lacs?|cr|crores?)?'
+    r'|\b\d[\d,]*(?:\.\d+)?\s*(?:k|l|lakhs?|lacs?|cr|crores?))\b',
+    re.IGNORECASE
+)
+
+# Phrases the rules cannot interpret; each escalates the listed fields to the LLM
+NEGATION_CUE = re.compile(
+    r"\b(?:not|no|don'?t|doesn'?t|isn'?t|except|other than|anywhere|any location|without|rather than|"
+    r"instead of|neither|nor|remove|forget|ignore|never ?mind)\b"
+)
+LOCATION_CUE = re.compile(r'\b(?:in|near|around|from|at)\s+([a-z]+)')
+# Where the student is from or lives, which need not be where they want to study
+ORIGIN_CUE = re.compile(
+    r'\b(?:from|(?:live|lives|living|stay|stays|staying|based|born|settled) in|hometown|native|belong|belongs|'
+    r'resident)\b'
+)
+COURSE_CUE = re.compile(
+    r'\b(?:course|courses|degree|program|programme|programs|branch|stream|study|studies|studying|'
+    r'specialization|specialisation|major|pursue|pursuing)\b'
+)
+COLLEGE_TYPE_CUE = re.compile(r'\b(?:central|state|autonomous|public)\b')
+LEVEL_CUE = re.compile(r'\b(?:12th|graduation|graduate|graduated|after school|higher studies)\b')
+
+# Words that may follow "in", "at", ... without naming a place
+NON_PLACE_WORDS = frozenset(
+    'india college colleges university universities institute general particular terms mind future life '
+    'class school year years top interested touch detail details advance case addition order fact short '
+    'total english hindi hostel hostels admission admissions placement placements ranking rankings '
+    'getting studying this these those them here there all both either your our his her its'.split()
+)
+
+
+@dataclass
+class PreferenceExtraction:
+    """Preference delta found by the rules, and the fields the rules could not settle"""
+    changes: Dict[str, str] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+    unresolved: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PreferenceLexicon:
+    """Gazetteer and course vocabulary generated from one catalog version"""
+    cities: Dict[str, str]                           # tokenized name -> display name
+    states: Dict[str, str]                           # tokenized name or alias -> canonical state
+    courses: List[Tuple[re.Pattern, str, str]]       # (pattern, code, display name)
+    course_types: Dict[str, str]                     # word -> course type that matches the catalog
+    family_types: Dict[str, Optional[str]]           # course code -> its course type, if it matches the catalog
+    college_types: Dict[str, str]                    # word -> college type that matches the catalog
+    levels: Dict[str, str]                           # tokenized level alias -> level
+    known_words: frozenset                           # every token the lexicon recognizes
+
+
+def build_lexicon(catalog: CollegeCatalog) -> PreferenceLexicon:
+    """Build the gazetteer and course lexicon from the colleges in the catalog"""
+    states = {}
+    for state, aliases in STATES.items():
+        for name in (state, *aliases):
+            states[' '.join(tokenize(name))] = state
+
+    # Place names are the pieces of the location column, minus streets, pin codes and remarks
+    cities = {}
+    for college in catalog.colleges:
+        for piece in LOCATION_SPLIT.split(college.location):
+            piece = LOCATION_PREFIX.sub('', re.sub(r'\d+', '', piece).strip(' .:'))
+            words = piece.split()
+            while words and words[-1].lower() in ('district', 'etc'):
+                words.pop()
+            key = ' '.join(tokenize(' '.join(words)))
+            if (not key or key in states or len(key) < 3 or len(key.split()) > 3
+                    or any(word in LOCATION_NOISE_WORDS for word in key.split())
+                    or all(word in SEARCH_STOPWORDS for word in key.split())):
+                continue
+            cities.setdefault(key, ' '.join(words))
+    for alias, name in CITY_ALIASES.items():
+        if name in cities and alias not in cities:
+            cities[alias] = cities[name]
+
+    # Courses offered somewhere in the catalog
+    courses = []
+    for code, pattern in COURSE_PATTERNS.items():
+        if code not in catalog.course_table.code_rows:
+            continue
+        flags = 0 if code in CASE_SENSITIVE_COURSES else re.IGNORECASE
+        courses.append((re.compile(f'(?<![A-Za-z]){pattern}(?![A-Za-z])', flags), code, COURSE_DISPLAY_NAMES.get(code, code)))
+
+    # Course and college types are only useful as preferences if the catalog text matches them
+    matching_course_types = {
+        course_type for course_type in set(COURSE_TYPE_WORDS.values()) | set(COURSE_FAMILIES)
+        if len(catalog.match('courses', course_type.lower()))
+    }
+    course_types = {word: course_type for word, course_type in COURSE_TYPE_WORDS.items() if course_type in matching_course_types}
+    family_types = {
+        code: (family if family in matching_course_types else None)
+        for family, codes in COURSE_FAMILIES.items() for code in codes
+    }
+    college_types = {
+        word: college_type for word, college_type in COLLEGE_TYPE_WORDS.items()
+        if len(catalog.match('type', college_type.lower()))
+    }
+
+    known_words = set()
+    for name in (*cities, *states, *STATE_ABBREVIATIONS, *course_types, *college_types, *LEVEL_ALIASES, *BUDGET_WORDS):
+        known_words.update(tokenize(name))
+    known_words.update(code.lower() for _, code, _ in courses)
+
+    return PreferenceLexicon(
+        cities=cities,
+        states=states,
+        courses=courses,
+        course_types=course_types,
+        family_types=family_types,
+        college_types=college_types,
+        levels={' '.join(tokenize(alias)): LEVEL_NAMES[level] for alias, level in LEVEL_ALIASES.items()},
+        known_words=frozenset(known_words)
+    )
+
+
+def _find_phrases(words: List[str], phrases: Dict[str, str], max_words: int = 3) -> List[str]:
+    """Values of the phrases found in the words, longest match first and without overlaps"""
+    found = []
+    i = 0
+    while i < len(words):
+        for n in range(min(max_words, len(words) - i), 0, -1):
+            value = phrases.get(' '.join(words[i:i + n]))
+            if value is not None:
+                found.append(value)
+                i += n
+                break
+        else:
+            i += 1
+    return list(dict.fromkeys(found))
+
+
+class PreferenceExtractor:
+    """Deterministic preference extraction from a single user message.
+
+    Cities come from the catalog's location column, states from a fixed
+    table, and courses, course types and college types are kept only if
+    the catalog can match them. Whatever the rules cannot settle (unknown
+    places, negations, budgets without an amount, ...) is reported as
+    unresolved so the caller can ask the LLM about those fields only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._lexicon = None
+        self.resolved = 0
+        self.escalated = 0
+
+    def lexicon(self, catalog: CollegeCatalog) -> PreferenceLexicon:
+        """Lexicon of the given catalog, rebuilt when the catalog is reloaded"""
+        with self._lock:
+            if self._catalog is not catalog:
+                self._lexicon = build_lexicon(catalog)
+                self._catalog = catalog
+            return self._lexicon
+
+    def extract(self, catalog: CollegeCatalog, text: str, stored: Optional[Dict] = None) -> PreferenceExtraction:
+        """Preference changes stated in the message, given the stored preferences"""
+        lexicon = self.lexicon(catalog)
+        stored = stored or {}
+        lowered = text.lower()
+        words = tokenize(text)
+        result = PreferenceExtraction()
+        unresolved = set()
+
+        # Location: a city from the catalog and/or a state
+        states = _find_phrases(words, lexicon.states)
+        states += [STATE_ABBREVIATIONS[abbreviation] for abbreviation in STATE_ABBREVIATION_PATTERN.findall(text)]
+        states = list(dict.fromkeys(states))
+        cities = _find_phrases(words, lexicon.cities)
+        if len(cities) > 1 or len(states) > 1 or ((cities or states) and ORIGIN_CUE.search(lowered)):
+            unresolved.update(('location', 'state'))
+        elif cities or states:
+            result.changes['location'] = cities[0] if cities else states[0]
+            if states:
+                result.changes['state'] = states[0]
+            elif stored.get('state'):
+                result.removed.append('state')  # the old state would widen the new location
+        for word in LOCATION_CUE.findall(lowered):
+            if word not in lexicon.known_words and word not in SEARCH_STOPWORDS and word not in NON_PLACE_WORDS:
+                unresolved.update(('location', 'state', 'course_type'))
+
+        # Courses: specific course codes, else a course type word
+        codes = list(dict.fromkeys(
+            (code, display) for pattern, code, display in lexicon.courses if pattern.search(text)
+        ))
+        course_types = _find_phrases(words, lexicon.course_types, max_words=1)
+        if len(codes) > 1 or len(course_types) > 1:
+            unresolved.update(('course_type', 'specific_course'))
+        elif codes:
+            code, display = codes[0]
+            result.changes['specific_course'] = display
+            course_type = course_types[0] if course_types else lexicon.family_types.get(code)
+            if course_type:
+                result.changes['course_type'] = course_type
+            elif stored.get('course_type'):
+                result.removed.append('course_type')
+        elif course_types:
+            result.changes['course_type'] = course_types[0]
+            stored_course = (stored.get('specific_course') or '').upper().replace(' ', '').replace('.', '')
+            if stored_course and lexicon.family_types.get(stored_course) != course_types[0]:
+                result.removed.append('specific_course')
+        elif COURSE_CUE.search(lowered):
+            unresolved.update(('course_type', 'specific_course'))
+
+        # College type
+        college_types = _find_phrases(words, lexicon.college_types, max_words=1)
+        if len(college_types) == 1:
+            result.changes['college_type'] = college_types[0]
+        elif college_types or COLLEGE_TYPE_CUE.search(lowered):
+            unresolved.add('college_type')
+
+        # Level
+        levels = _find_phrases(words, lexicon.levels, max_words=2)
+        if len(levels) == 1:
+            result.changes['level'] = levels[0]
+        elif levels or LEVEL_CUE.search(lowered):
+            unresolved.add('level')
+
+        # Budget: an amount with a unit or currency, or a budget word next to a budget cue
+        amounts = [match.group(0).strip() for match in BUDGET_AMOUNT.finditer(text)]
+        budget_words = [word for word in BUDGET_WORDS if word in words]
+        if len(amounts) == 1:
+            result.changes['budget_range'] = amounts[0]
+        elif len(budget_words) == 1 and BUDGET_CUE.search(lowered) and not amounts:
+            result.changes['budget_range'] = budget_words[0]
+        elif amounts or BUDGET_CUE.search(lowered):
+            unresolved.add('budget_range')
+
+        # Negations and withdrawals change the meaning of everything above
+        if NEGATION_CUE.search(lowered):
+            unresolved.update(PREFERENCE_FIELDS)
+
+        for name in unresolved:
+            result.changes.pop(name, None)
+        result.removed = [name for name in result.removed if name not in unresolved]
+        result.unresolved = [name for name in PREFERENCE_FIELDS if name in unresolved]
+
+        with self._lock:
+            if result.unresolved:
+                self.escalated += 1
+            else:
+                self.resolved += 1
+        return result
+
+    def stats(self) -> Dict:
+        """How many messages the rules settled on their own"""
+        with self._lock:
+            total = self.resolved + self.escalated
+            return {
+                'resolved_locally': self.resolved,
+                'escalated': self.escalated,
+                'local_hit_rate': self.resolved / total if total else 0.0
+            }